@@ -0,0 +1,129 @@
+import sys
+import time
+import argparse
+import hashlib
+from dataclasses import dataclass
+from renderer import *
+from game_objects import *
+from game import item_setup, controls, GRAVITY
+from collision import ColliderBatch
+from framebuffer import FrameBuffer
+from inputs import ReplayInput
+
+"""
+Replays a recorded play session without a window and reports how long physics and rendering took.
+The final camera position and frame checksum make it a regression test as well: the same recording
+and code always give the same numbers, and --check compares the recordings in Recordings/ against them.
+"""
+
+
+@dataclass
+class ReplayReference:
+    position: tuple  # Where the camera ends up.
+    y_rotation: float
+    checksum: str  # SHA-1 of the last 320x240 frame.
+
+
+# What each committed recording should end on, update on purpose when physics or rendering are meant to change.
+REFERENCE_REPLAYS = {
+    "Recordings/map1_walk.rec": ReplayReference((5.847680, 1.900954, -3.144961), 146.820158,
+                                                "77c3ecd1bb1b4e46850744873fbb4d6f467382a6"),
+}
+
+
+def run(recording: str, width: int = 320, height: int = 240, render_frames: bool = True) -> dict:
+    """
+    Replays a recording through the game's physics and the headless renderer.
+    :param recording: A file written with game.py --record.
+    :param width: Width of the rendered frames.
+    :param height: Height of the rendered frames.
+    :param render_frames: Set to False to only time the physics.
+    :return: Timings and the final state of the run.
+    """
+    keys = ReplayInput(recording)
+    cam = Camera(Vector3(0, 7, -3), -89, 1, [0, 0, 0], 0)
+    ground = SphereCollider(cam.position + Vector3(0, -1.5, 0), 0, 0.4)
+    wall = SphereCollider(cam.position + Vector3(0, -1.3, 0), 0, 0.5)
+    items, colliders, entities, loader = item_setup(cam)
+    poly, collide = loader.wait()
+    items.extend(poly)
+    colliders = ColliderBatch(colliders + collide)
+    t = FrameBuffer(width, height)
+    init(t)
+
+    physics_time = 0
+    render_time = 0
+    frames = 0
+    end = 0
+    while end == 0:
+        start = time.perf_counter()
+        ticks = keys.tick()
+        end = controls(cam, ground, wall, colliders, ticks, keys)
+        entities.update(ticks, colliders, GRAVITY)
+        physics_time += time.perf_counter() - start
+        if end == 0 and render_frames:
+            start = time.perf_counter()
+            render(cam, items, t, None, entities)
+            render_time += time.perf_counter() - start
+            frames += 1
+
+    return {"steps": len(keys),
+            "frames": frames,
+            "physics_ms": physics_time * 1000,
+            "render_ms": render_time * 1000,
+            "position": (cam.position.x, cam.position.y, cam.position.z),
+            "y_rotation": cam.y_rotation,
+            "checksum": hashlib.sha1(t.pixels).hexdigest()}
+
+
+def check_replays(references: dict = None) -> list:
+    """
+    Replays each reference recording and compares where it ends up.
+    :return: A message for each recording that didn't match, empty if all did.
+    """
+    if references is None:
+        references = REFERENCE_REPLAYS
+    failures = []
+    for recording, reference in references.items():
+        result = run(recording)
+        if any(abs(a - b) > 1e-6 for a, b in zip(result["position"], reference.position)) or \
+                abs(result["y_rotation"] - reference.y_rotation) > 1e-6:
+            failures.append("%s ends at %.6f %.6f %.6f, rotation %.6f, expected %.6f %.6f %.6f, rotation %.6f"
+                            % (recording, *result["position"], result["y_rotation"], *reference.position,
+                               reference.y_rotation))
+        if result["checksum"] != reference.checksum:
+            failures.append("%s last frame checksum is %s, expected %s"
+                            % (recording, result["checksum"], reference.checksum))
+    return failures
+
+
+def main(args: list = None):
+    parser = argparse.ArgumentParser(description="Replays a recorded session headless and times it.")
+    parser.add_argument("recording", nargs="?", help="file written with game.py --record")
+    parser.add_argument("--size", default="320x240", help="frame size, WIDTHxHEIGHT")
+    parser.add_argument("--physics-only", action="store_true", help="skip rendering")
+    parser.add_argument("--check", action="store_true", help="check the recordings in Recordings/ still replay the same")
+    options = parser.parse_args(args)
+    if options.check:
+        failures = check_replays()
+        for failure in failures:
+            print("MISMATCH: " + failure)
+        if not failures:
+            print("%d recordings replay the same" % len(REFERENCE_REPLAYS))
+        sys.exit(1 if failures else 0)
+    if options.recording is None:
+        parser.error("give a recording or --check")
+    width, height = (int(n) for n in options.size.split("x"))
+
+    result = run(options.recording, width, height, not options.physics_only)
+    steps = max(result["steps"], 1)
+    print("steps:    %d" % result["steps"])
+    print("physics:  %.1f ms (%.3f ms/step)" % (result["physics_ms"], result["physics_ms"] / steps))
+    if result["frames"]:
+        print("render:   %.1f ms (%.3f ms/frame)" % (result["render_ms"], result["render_ms"] / result["frames"]))
+    print("position: %.6f %.6f %.6f, rotation %.6f" % (*result["position"], result["y_rotation"]))
+    print("checksum: %s" % result["checksum"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,306 @@
+import math
+import numpy as np
+from game_objects import *
+
+"""
+Packs colliders into arrays per type so that many spheres can be tested against the world at once.
+The results match SphereCollider.overlap for every collider.
+"""
+
+COLLIDER_TYPES = (SphereCollider, PlaneCollider, SlopeCollider, WallCollider)
+SKIN = 0.001  # How far in front of a surface a sweep stops.
+
+
+class PackedColliders:
+    """
+    All colliders of one type stored as arrays.
+    """
+    def __init__(self, kind: type, colliders: list, indices: list):
+        self.kind = kind
+        self.colliders = colliders
+        self.indices = np.array(indices, dtype=np.intp)  # Index of each collider in the original list.
+        count = len(colliders)
+        self.position = np.zeros((count, 3))
+        self.rotation = np.zeros(count)
+        self.extents = np.zeros((count, 2))  # x/z for planes and slopes, x/y for walls, r for spheres.
+        self.slope = np.zeros(count)
+        for i, col in enumerate(colliders):
+            self.position[i] = (col.position.x, col.position.y, col.position.z)
+            self.rotation[i] = col.y_rotation
+            if kind == SphereCollider:
+                self.extents[i, 0] = col.r
+            elif kind == WallCollider:
+                self.extents[i] = (col.x, col.y)
+            else:
+                self.extents[i] = (col.x, col.z)
+            if kind == SlopeCollider:
+                self.slope[i] = col.slope
+        self.sin = np.sin(self.rotation * (math.pi / 180))
+        self.cos = np.cos(self.rotation * (math.pi / 180))
+
+    def __len__(self):
+        return len(self.colliders)
+
+    def overlap(self, positions: np.ndarray, radii: np.ndarray) -> np.ndarray:
+        """
+        Finds how far each sphere overlaps each collider, the same way SphereCollider.overlap does.
+        :param positions: (M, 3) array of sphere centers.
+        :param radii: (M,) array of sphere radii.
+        :return: (M, N) array of overlaps, positive means colliding.
+        """
+        r = radii[:, None]
+        px = self.position[:, 0]
+        py = self.position[:, 1]
+        pz = self.position[:, 2]
+        if self.kind == SphereCollider:
+            diff = positions[:, None, :] - self.position[None, :, :]
+            return (r + self.extents[:, 0]) - np.sqrt((diff ** 2).sum(axis=2))
+
+        # Rotate every sphere into each collider's space, only around y like Vector3.rotate_around.
+        rx = positions[:, 0:1] - px
+        rz = positions[:, 2:3] - pz
+        x = rx * self.cos - rz * self.sin + px
+        y = np.broadcast_to(positions[:, 1:2], x.shape)
+        z = rx * self.sin + rz * self.cos + pz
+        ex = self.extents[:, 0]
+        ey = self.extents[:, 1]
+
+        if self.kind == WallCollider:
+            inside = (px < x) & (x < px + ex) & (py < y) & (y < py + ey) & (pz - z < r)
+            inside_overlap = r - np.abs(pz - z)
+            dx = np.minimum(np.abs(px - x), np.abs(px + ex - x))
+            dy = np.abs(pz - z)
+            dz = np.minimum(np.abs(py - y), np.abs(py + ey - y))
+        else:
+            inside = (px < x) & (x < px + ex) & (pz < z) & (z < pz + ey)
+            dy = np.abs(py - y) + self.slope * (pz - z)
+            inside_overlap = r - dy
+            dx = np.minimum(np.abs(px - x), np.abs(px + ex - x))
+            dz = np.minimum(np.abs(pz - z), np.abs(pz + ey - z))
+        outside_overlap = r - np.sqrt((x - dx) ** 2 + (y - dy) ** 2 + (z - dz) ** 2)
+        return np.where(inside, inside_overlap, outside_overlap)
+
+    def sweep(self, positions: np.ndarray, radii: np.ndarray, displacements: np.ndarray) -> tuple:
+        """
+        Finds when each moving sphere first touches each collider's surface.
+        Surfaces are treated as one-sided towards the side the sphere starts on, and rectangles are
+        grown by the sphere radius so spheres can't slip past edges.
+        :param positions: (M, 3) array of sphere centers at the start of the step.
+        :param radii: (M,) array of sphere radii.
+        :param displacements: (M, 3) array of how far each sphere moves this step.
+        :return: (toi, normal) where toi is an (M, N) array of the fraction of the step at which
+                 each sphere hits each collider (inf for no hit) and normal is an (M, N, 3) array of
+                 world space surface normals facing the sphere.
+        """
+        count = (len(positions), len(self.colliders))
+        if self.kind == SphereCollider:
+            # Solve |p + d*t - c| = r1 + r2 for the smallest t.
+            diff = positions[:, None, :] - self.position[None, :, :]
+            d = np.broadcast_to(displacements[:, None, :], diff.shape)
+            r = radii[:, None] + self.extents[:, 0]
+            a = (d ** 2).sum(axis=2)
+            b = 2 * (diff * d).sum(axis=2)
+            c = (diff ** 2).sum(axis=2) - r ** 2
+            disc = b ** 2 - 4 * a * c
+            with np.errstate(divide="ignore", invalid="ignore"):
+                t = (-b - np.sqrt(np.maximum(disc, 0))) / (2 * a)
+            hit = (disc >= 0) & (a > 0) & (t <= 1) & (b < 0)
+            toi = np.where(hit, np.where(c <= 0, 0, np.maximum(t, 0)), np.inf)
+            contact = diff + d * np.where(np.isfinite(toi), toi, 0)[:, :, None]
+            length = np.sqrt((contact ** 2).sum(axis=2, keepdims=True))
+            normal = np.divide(contact, length, out=np.zeros_like(contact), where=length > 0)
+            return toi, normal
+
+        px = self.position[:, 0]
+        py = self.position[:, 1]
+        pz = self.position[:, 2]
+        r = radii[:, None]
+        rx = positions[:, 0:1] - px
+        rz = positions[:, 2:3] - pz
+        x = rx * self.cos - rz * self.sin + px
+        y = np.broadcast_to(positions[:, 1:2], count)
+        z = rx * self.sin + rz * self.cos + pz
+        dx = displacements[:, 0:1] * self.cos - displacements[:, 2:3] * self.sin
+        dy = np.broadcast_to(displacements[:, 1:2], count)
+        dz = displacements[:, 0:1] * self.sin + displacements[:, 2:3] * self.cos
+        ex = self.extents[:, 0]
+        ey = self.extents[:, 1]
+
+        # Height above the surface along its local normal, and the local normal itself.
+        if self.kind == WallCollider:
+            height = z - pz
+            rate = dz
+            local_normal = np.stack([np.zeros_like(ex), np.zeros_like(ex), np.ones_like(ex)], axis=1)
+        else:
+            height = (y - py) - self.slope * (z - pz)
+            rate = dy - self.slope * dz
+            local_normal = np.stack([np.zeros_like(ex), np.ones_like(ex), -self.slope], axis=1)
+            local_normal /= np.sqrt((local_normal ** 2).sum(axis=1, keepdims=True))
+            # Slopes are measured vertically, turn the vertical gap into the real distance.
+            scale = local_normal[:, 1]
+            height = height * scale
+            rate = rate * scale
+        side = np.where(height >= 0, 1.0, -1.0)
+        gap = side * height - r
+        approach = -side * rate
+        hit = approach > 0
+        t = np.divide(gap, approach, out=np.zeros(count), where=hit & (gap > 0))
+        hit &= t <= 1
+
+        hx = x + dx * t
+        hy = y + dy * t
+        hz = z + dz * t
+        if self.kind == WallCollider:
+            within = (px - r <= hx) & (hx <= px + ex + r) & (py - r <= hy) & (hy <= py + ey + r)
+        else:
+            within = (px - r <= hx) & (hx <= px + ex + r) & (pz - r <= hz) & (hz <= pz + ey + r)
+        toi = np.where(hit & within, t, np.inf)
+
+        # Rotate the normals back into world space.
+        nx = local_normal[:, 0] * self.cos + local_normal[:, 2] * self.sin
+        nz = -local_normal[:, 0] * self.sin + local_normal[:, 2] * self.cos
+        normal = np.stack(np.broadcast_arrays(nx, local_normal[:, 1], nz), axis=1)
+        normal = normal[None, :, :] * side[:, :, None]
+        return toi, normal
+
+
+class ColliderBatch:
+    """
+    A scene's colliders grouped by type for batched overlap queries.
+    """
+    def __init__(self, colliders: list):
+        self.colliders = list(colliders)
+        self.groups = {}
+        for kind in COLLIDER_TYPES:
+            indices = [i for i, col in enumerate(self.colliders) if type(col) == kind]
+            if indices:
+                self.groups[kind] = PackedColliders(kind, [self.colliders[i] for i in indices], indices)
+
+    def __len__(self):
+        return len(self.colliders)
+
+    def __iter__(self):
+        return iter(self.colliders)
+
+    def overlap(self, spheres: list, kind: type = None) -> np.ndarray:
+        """
+        Tests many spheres against every collider (or every collider of one type) at once.
+        :param spheres: A list of SphereColliders.
+        :param kind: Only test against this collider type if given.
+        :return: (len(spheres), len(colliders)) array of overlaps in the original collider order,
+                 colliders of other types are set to -inf.
+        """
+        positions, radii = pack_spheres(spheres)
+        return self.overlap_arrays(positions, radii, kind)
+
+    def overlap_arrays(self, positions: np.ndarray, radii: np.ndarray, kind: type = None) -> np.ndarray:
+        """
+        Same as overlap() but takes sphere centers and radii as arrays.
+        """
+        result = np.full((len(positions), len(self.colliders)), -np.inf)
+        for group in self._groups(kind):
+            result[:, group.indices] = group.overlap(positions, radii)
+        return result
+
+    def _groups(self, kind) -> list:
+        if kind is None:
+            return list(self.groups.values())
+        if isinstance(kind, type):
+            kind = (kind,)
+        return [group for group_kind, group in self.groups.items() if group_kind in kind]
+
+    def deepest(self, sphere: SphereCollider, kind: type = None) -> tuple:
+        """
+        Finds the collider a sphere overlaps the most.
+        :return: (overlap, collider), collider is None if the sphere touches nothing.
+        """
+        overlaps, indices = self.deepest_arrays(*pack_spheres([sphere]), kind)
+        if indices[0] < 0:
+            return overlaps[0], None
+        return overlaps[0], self.colliders[indices[0]]
+
+    def deepest_arrays(self, positions: np.ndarray, radii: np.ndarray, kind: type = None) -> tuple:
+        """
+        Finds the deepest contact for every sphere.
+        :return: (overlaps, indices) arrays, index is -1 where a sphere touches nothing.
+        """
+        if len(self.colliders) == 0:
+            return np.full(len(positions), -np.inf), np.full(len(positions), -1, dtype=np.intp)
+        overlaps = self.overlap_arrays(positions, radii, kind)
+        indices = overlaps.argmax(axis=1)
+        depth = overlaps[np.arange(len(positions)), indices]
+        indices[~(depth > 0)] = -1
+        return depth, indices
+
+    def sweep(self, sphere: SphereCollider, displacement: Vector3, kind=None) -> tuple:
+        """
+        Moves a sphere along a displacement and finds the first collider it hits on the way.
+        :param sphere: The sphere at the start of the step.
+        :param displacement: How far the sphere moves this step.
+        :param kind: Only test against this collider type (or tuple of types) if given.
+        :return: (toi, collider, normal), toi is the fraction of the step travelled before the hit,
+                 1 and None if nothing is hit.
+        """
+        positions, radii = pack_spheres([sphere])
+        displacements = np.array([(displacement.x, displacement.y, displacement.z)], dtype=float)
+        toi, indices, normals = self.sweep_arrays(positions, radii, displacements, kind)
+        if indices[0] < 0:
+            return 1, None, None
+        return float(toi[0]), self.colliders[indices[0]], Vector3(*(float(n) for n in normals[0]))
+
+    def sweep_arrays(self, positions: np.ndarray, radii: np.ndarray, displacements: np.ndarray, kind=None) -> tuple:
+        """
+        Sweeps many spheres at once.
+        :return: (toi, indices, normals) arrays, toi is 1 and index is -1 where a sphere hits nothing.
+        """
+        toi = np.ones(len(positions))
+        indices = np.full(len(positions), -1, dtype=np.intp)
+        normals = np.zeros((len(positions), 3))
+        rows = np.arange(len(positions))
+        for group in self._groups(kind):
+            if len(group) == 0:
+                continue
+            group_toi, group_normal = group.sweep(positions, radii, displacements)
+            first = group_toi.argmin(axis=1)
+            first_toi = group_toi[rows, first]
+            closer = first_toi < toi
+            toi[closer] = first_toi[closer]
+            indices[closer] = group.indices[first[closer]]
+            normals[closer] = group_normal[rows, first][closer]
+        return toi, indices, normals
+
+    def slide(self, sphere: SphereCollider, displacement: Vector3, kind=None, iterations: int = 3) -> Vector3:
+        """
+        Moves a sphere as far as it can along a displacement, sliding along any surfaces it hits.
+        :return: The displacement the sphere can make without passing through a collider.
+        """
+        start = sphere.position
+        moved = Vector3(0, 0, 0)
+        remaining = displacement
+        for i in range(iterations):
+            length = remaining.magnitude()
+            if length == 0:
+                break
+            sphere.position = start + moved
+            toi, col, normal = self.sweep(sphere, remaining, kind)
+            if col is None:
+                moved += remaining
+                break
+            t = max(0.0, toi - SKIN / length)
+            moved += remaining.scale(t)
+            remaining = remaining.scale(1 - t)
+            # Remove the part of the remaining movement going into the surface.
+            into = remaining ^ normal
+            if into < 0:
+                remaining -= normal.scale(into)
+        sphere.position = start
+        return moved
+
+
+def pack_spheres(spheres: list) -> tuple:
+    """
+    Turns a list of SphereColliders into (positions, radii) arrays.
+    """
+    positions = np.array([(s.position.x, s.position.y, s.position.z) for s in spheres], dtype=float).reshape(-1, 3)
+    radii = np.array([s.r for s in spheres], dtype=float)
+    return positions, radii
@@ -0,0 +1,164 @@
+import os
+from dataclasses import dataclass
+from typing import Union
+from vectors import *
+
+"""
+Keeps track of the objects placed in the editor. Every placement and removal is appended to a journal
+file straight away, and on exit the journal is compacted into an .obj made of file lines.
+If the editor closes without compacting, the journal is replayed the next time the scene is opened.
+"""
+
+
+@dataclass
+class Placement:
+    name: str
+    position: Vector3
+    y_rotation: float
+    scale: Vector3
+
+    def line(self) -> str:
+        """
+        The .obj file line that loads this placement: file <name> <position> <yrotation> <scale>
+        """
+        return "file %s %r %r %r %r %r %r %r" % (self.name, self.position.x, self.position.y, self.position.z,
+                                                 self.y_rotation, self.scale.x, self.scale.y, self.scale.z)
+
+
+def parse_placement(split: list) -> Placement:
+    n = [float(s) for s in split[1:8]]
+    return Placement(split[0], Vector3(n[0], n[1], n[2]), n[3], Vector3(n[4], n[5], n[6]))
+
+
+class EditorScene:
+    """
+    The placements making up an edited scene, by id.
+    Placed objects' polygons and colliders are kept in objects so they can be removed again.
+    """
+    def __init__(self, name: str, placements: list = ()):
+        self.name = name
+        self.placements = {}
+        self.objects = {}  # id -> (polygons, colliders) once loaded.
+        self._owners = {}  # id() of a polygon or collider -> placement id.
+        self.base = set()  # Ids of the placements of the map the scene was started from, they can't be removed.
+        self.next_id = 0
+        for placement in placements:
+            self.placements[self.next_id] = placement
+            self.next_id += 1
+        self.journal_path = "Objects/" + name + ".journal"
+        self._journal = None
+
+    @classmethod
+    def open(cls, filename: str):
+        """
+        Opens a scene to edit. A scene made only of file lines is edited in place, anything else is
+        included whole as the first placement of a new scene called <filename>_scene.
+        Placements left in a journal from an earlier session are replayed.
+        In a <filename>_scene, the placements of <filename> are its base and can't be removed.
+        """
+        placements = []
+        editable = True
+        with open("Objects/" + filename + ".obj") as file:
+            for line in file:
+                split = line.split()
+                if not split:
+                    continue
+                if split[0] == "file" and len(split) == 9:
+                    placements.append(parse_placement(split[1:]))
+                else:
+                    editable = False
+        if not editable:
+            # Carry on from an earlier edit of this file if there is one.
+            if os.path.exists("Objects/" + filename + "_scene.obj"):
+                return cls.open(filename + "_scene")
+            placements = [Placement(filename, Vector3(0, 0, 0), 0, Vector3(1, 1, 1))]
+            filename += "_scene"
+        scene = cls(filename, placements)
+        if filename.endswith("_scene"):
+            scene.base = {i for i, placement in scene.placements.items()
+                          if placement.name == filename[:-len("_scene")]}
+        scene.replay()
+        return scene
+
+    def replay(self):
+        """
+        Applies the journal left by a session that didn't compact.
+        """
+        if not os.path.exists(self.journal_path):
+            return
+        with open(self.journal_path) as file:
+            for line in file:
+                split = line.split()
+                if not split:
+                    continue
+                if split[0] == "add" and len(split) == 10:
+                    i = int(split[1])
+                    self.placements[i] = parse_placement(split[2:])
+                    self.next_id = max(self.next_id, i + 1)
+                elif split[0] == "remove" and len(split) == 2:
+                    self.placements.pop(int(split[1]), None)
+                # Anything else is a half written line from a crash.
+
+    def _write(self, line: str):
+        if self._journal is None:
+            self._journal = open(self.journal_path, "a")
+        self._journal.write(line + "\n")
+        self._journal.flush()
+
+    def place(self, name: str, position: Vector3, y_rotation: float, scale: Vector3) -> int:
+        """
+        Adds a placement and journals it.
+        :return: The placement's id.
+        """
+        i = self.next_id
+        self.next_id += 1
+        placement = Placement(name, position, y_rotation, scale)
+        self.placements[i] = placement
+        self._write("add %d %s" % (i, placement.line()[5:]))
+        return i
+
+    def remove(self, i: int) -> tuple:
+        """
+        Removes a placement and journals it, base placements are left alone.
+        :return: The polygons and colliders that were loaded for it.
+        """
+        if i not in self.placements or i in self.base:
+            return [], []
+        del self.placements[i]
+        self._write("remove %d" % i)
+        polygons, colliders = self.objects.pop(i, ([], []))
+        for item in polygons + colliders:
+            self._owners.pop(id(item), None)
+        return polygons, colliders
+
+    def loaded(self, i: int, polygons: list, colliders: list):
+        """
+        Records polygons and colliders that were loaded for a placement.
+        """
+        if i not in self.objects:
+            self.objects[i] = ([], [])
+        self.objects[i][0].extend(polygons)
+        self.objects[i][1].extend(colliders)
+        for item in polygons + colliders:
+            self._owners[id(item)] = i
+
+    def find(self, item) -> Union[None, int]:
+        """
+        Finds which placement a polygon or collider belongs to.
+        """
+        return self._owners.get(id(item))
+
+    def compact(self):
+        """
+        Writes the placements to Objects/<name>.obj as file lines and clears the journal.
+        """
+        path = "Objects/" + self.name + ".obj"
+        with open(path + ".tmp", "w") as file:
+            for placement in self.placements.values():
+                file.write(placement.line() + "\n")
+        os.replace(path + ".tmp", path)
+        if self._journal is not None:
+            self._journal.close()
+            self._journal = None
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
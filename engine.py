@@ -1,32 +1,54 @@
 import math
 import time
-import keyboard
 import os
+import argparse
 from renderer import *
 from game_objects import *
-from game import create_file_object
+from quality import QualityController, print_decision
+from loader import AssetCache, AssetLoader, build_object, shared_executor
+from raycast import SceneRaycaster
+from editor_scene import EditorScene
+from inputs import LiveInput, open_input
 
 """
 This Program launches and runs the game so you can add objects and save the 
-scene to render later.
+scene to render later. Press space to place the selected object (1 or 2) where the camera is looking,
+backspace to remove the object under the cursor. The scene is saved to Objects/ when you press escape.
 """
 
 SELECTED = 0
 CHANGE = False
 CHANGE_CHECK = False
+REMOVE = False
+REMOVE_CHECK = False
 ITEMS = ["cube", "ramp"]
 
 POS_LOCK = 1
 ROT_LOCK = 45
 
-def controls(cam: Camera, items: list) -> int:
+def snap(position: Vector3) -> Vector3:
+    """
+    Locks a position to the POS_LOCK grid.
+    """
+    return Vector3(math.floor((position.x/POS_LOCK) + (POS_LOCK/2))*POS_LOCK, math.floor((position.y/POS_LOCK) + (POS_LOCK/2))*POS_LOCK, math.floor((position.z/POS_LOCK) + (POS_LOCK/2))*POS_LOCK)
+
+
+def controls(cam: Camera, items: list, frame: FrameState = None, keys=None, picker: SceneRaycaster = None,
+             scene: EditorScene = None, cache: AssetCache = None) -> int:
     """
     Allows user to press keyboard buttons to move and rotate the camera around the virtual world.
     This function also simulates player gravity and collision.
     :param cam: The location, rotation, and all other information of the camera.
     :param ground: Collider that detects the ground.
     :param wall: Collider that detects walls.
+    :param frame: Told when a placed object changes the scene.
+    :param keys: Where key presses come from, the live keyboard if None.
+    :param picker: Finds the surface the camera is looking at, objects are placed there when given.
+    :param scene: Records placed and removed objects.
+    :param cache: Parsed object files, so placing an object doesn't read its file again.
     """
+    if keys is None:
+        keys = LiveInput()
     move_fb = 0
     move_ss = 0
     move_ud = 0
@@ -35,34 +57,37 @@ def controls(cam: Camera, items: list) -> int:
     global SELECTED
     global CHANGE
     global CHANGE_CHECK
-    if keyboard.is_pressed("shift"):
+    global REMOVE
+    global REMOVE_CHECK
+    if keys.is_pressed("shift"):
         multiply = 1.5
-    if keyboard.is_pressed("w"):
+    if keys.is_pressed("w"):
         move_fb += 0.1
-    if keyboard.is_pressed("s"):
+    if keys.is_pressed("s"):
         move_fb -= 0.1
-    if keyboard.is_pressed("a"):
+    if keys.is_pressed("a"):
         move_ss += 0.1
-    if keyboard.is_pressed("d"):
+    if keys.is_pressed("d"):
         move_ss -= 0.1
-    if keyboard.is_pressed("e"):
+    if keys.is_pressed("e"):
         move_ud += 0.1
-    if keyboard.is_pressed("q"):
+    if keys.is_pressed("q"):
         move_ud -= 0.1
-    if keyboard.is_pressed("left arrow"):
+    if keys.is_pressed("left arrow"):
         rotation += 4
-    if keyboard.is_pressed("right arrow"):
+    if keys.is_pressed("right arrow"):
         rotation -= 4
-    if keyboard.is_pressed("escape"):
+    if keys.is_pressed("escape"):
         return 1
-    if keyboard.is_pressed("1"):
+    if keys.is_pressed("1"):
         SELECTED = 0
-    if keyboard.is_pressed("2"):
+    if keys.is_pressed("2"):
         SELECTED = 1
-    if keyboard.is_pressed("space"):
+    if keys.is_pressed("space"):
         CHANGE = True
-    if not keyboard.is_pressed("space"):
+    if not keys.is_pressed("space"):
         CHANGE = False
+    REMOVE = keys.is_pressed("backspace")
 
     cam.acceleration[0] = (cam.acceleration[0] + move_fb * 2) / 2
     cam.acceleration[1] = (cam.acceleration[1] + move_ss * 2) / 2
@@ -75,59 +100,129 @@ def controls(cam: Camera, items: list) -> int:
     cam.y_rotation += cam.angular_acceleration
 
     if CHANGE_CHECK == False and CHANGE == True:
-        pos = Vector3(math.floor((cam.position.x/POS_LOCK) + (POS_LOCK/2))*POS_LOCK, math.floor((cam.position.y/POS_LOCK) + (POS_LOCK/2))*POS_LOCK, math.floor((cam.position.z/POS_LOCK) + (POS_LOCK/2))*POS_LOCK)
+        pos = snap(cam.position)
+        if picker is not None:
+            # Place the object against the surface the camera is looking at.
+            hit = picker.raycast(cam.position, cam.forward())
+            if hit is not None:
+                pos = snap(hit.point + hit.normal.scale(POS_LOCK / 2))
         rot = math.floor((cam.y_rotation/ROT_LOCK)+(ROT_LOCK/2))*ROT_LOCK
-        poly, collide = create_file_object(ITEMS[SELECTED], pos, rot, Vector3(1, 1, 1))
+        if cache is None:
+            cache = AssetCache(shared_executor())
+        poly, collide = build_object(cache.load_tree(ITEMS[SELECTED]), ITEMS[SELECTED], pos, rot, Vector3(1, 1, 1))
         items.extend(poly)
+        if scene is not None:
+            scene.loaded(scene.place(ITEMS[SELECTED], pos, rot, Vector3(1, 1, 1)), poly, collide)
+        if picker is not None:
+            picker.add(poly, collide)
+        if frame is not None:
+            frame.scene_changed()
     CHANGE_CHECK = CHANGE
 
+    if REMOVE_CHECK == False and REMOVE == True and picker is not None and scene is not None:
+        hit = picker.raycast(cam.position, cam.forward())
+        placement = None if hit is None else scene.find(hit.item)
+        # The map being edited is one placement, only what was placed on it can be removed.
+        if placement is not None and placement not in scene.base:
+            poly, collide = scene.remove(placement)
+            gone = set(id(item) for item in poly)
+            items[:] = [item for item in items if id(item) not in gone]
+            picker.remove(poly + collide)
+            if frame is not None:
+                frame.scene_changed()
+    REMOVE_CHECK = REMOVE
+
     return 0
 
 
-def item_setup(cam, file) -> list:
+def item_setup(cam, file) -> tuple:
     """
     Generates the scene.
     :param cam: The camera
     :param colliders: The scenes colliders
-    :return: List of polygons to be added to the render list.
+    :return: List of polygons to be added to the render list, the scene being edited, a list of
+             (placement id, loader) for the placed objects still loading in the background, and the
+             files they share, parsed once each.
     """
     items = list()
+    scene = None
+    loaders = []
+    cache = AssetCache(shared_executor())
     if (os.path.exists("Objects/" + file + ".obj")):
-        poly, collide = create_file_object(file, Vector3(0, 0, 0), 0, Vector3(1, 1, 1))
-        items.extend(poly)
+        scene = EditorScene.open(file)
+        for placement_id, placement in scene.placements.items():
+            loaders.append((placement_id, AssetLoader(placement.name, placement.position, placement.y_rotation,
+                                                      placement.scale, cache=cache)))
     else:
         print("Nuh Uh")
 
-    return items
+    return items, scene, loaders, cache
 
 
-def main():
+def main(args: list = None):
     """
     Sets up world, displays world and allows you to move camera around world.
+    :param args: Command line options, --record or --replay a file of key presses.
     """
-    file = input("Enter file name:")
+    parser = argparse.ArgumentParser(description="Runs the scene editor.")
+    parser.add_argument("--record", help="record key presses to this file")
+    parser.add_argument("--replay", help="replay key presses from this file instead of the keyboard")
+    parser.add_argument("file", nargs="?", help="scene to open, asked for if not given")
+    options = parser.parse_args(args)
+    keys = open_input(options.record, options.replay)
+
+    file = options.file
+    if file is None:
+        file = input("Enter file name:")
 
     cam = Camera(Vector3(0, 2, -3), -89, 1, [0, 0, 0], 0)
 
-    items = item_setup(cam, file)
+    items, scene, loaders, cache = item_setup(cam, file)
+    picker = SceneRaycaster(items)
     turtle1 = Turtle()
     turtle2 = Turtle()
     init(turtle1)
     init(turtle2)
 
+    quality = QualityController(report=print_decision)
+
     i = 0
     end = 0
+    frame = FrameState()
     while end == 0:
-        if i % 2 == 0:
-            t = turtle1
-        else:
-            t = turtle2
-        i += 1
+        quality.begin_frame()
+        # Add any of the scene that finished loading.
+        for placement_id, loader in list(loaders):
+            for poly, collide in loader.poll():
+                if placement_id not in scene.placements:
+                    continue  # Removed before it finished loading.
+                items.extend(poly)
+                picker.add(poly, collide)
+                scene.loaded(placement_id, poly, collide)
+                frame.scene_changed()
+            if loader.done:
+                if loader.error is not None:
+                    print("Could not load " + loader.filename + ": " + str(loader.error))
+                loaders.remove((placement_id, loader))
         # Controls
-        end = controls(cam, items)
-        # Visuals
-        render(cam, items, t)
+        keys.tick()
+        end = controls(cam, items, frame, keys, picker, scene, cache)
+        # Visuals, only redrawn when something on screen changed.
+        if frame.needs_render(cam, quality.settings):
+            if i % 2 == 0:
+                t = turtle1
+            else:
+                t = turtle2
+            i += 1
+            render(cam, items, t, quality.settings)
+            quality.end_frame()
+        else:
+            turtle1.screen.update()
         time.sleep(0.02)
+    keys.close()
+    if scene is not None:
+        scene.compact()
+        print("Saved Objects/" + scene.name + ".obj")
 
 
 if __name__ == "__main__":
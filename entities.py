@@ -0,0 +1,170 @@
+import math
+import numpy as np
+from game_objects import *
+from renderer import SpriteDraw
+from collision import ColliderBatch, SKIN
+
+"""
+Stores many moving sprites (enemies, pickups, ...) in arrays so they can be updated and projected together.
+"""
+
+
+class EntityStore:
+    """
+    Entities are rows in a set of arrays, an entity's id is its row.
+    Removed rows are reused by later spawns.
+    """
+    def __init__(self, capacity: int = 64):
+        self.position = np.zeros((capacity, 3))
+        self.velocity = np.zeros((capacity, 3))
+        self.radius = np.zeros(capacity)
+        self.sprite = np.zeros(capacity, dtype=np.intp)
+        self.scale = np.zeros(capacity)
+        self.alive = np.zeros(capacity, dtype=bool)
+        self.sprites = []  # Sprite file names, indexed by sprite id.
+        self._sprite_ids = {}
+        self._free = list(range(capacity - 1, -1, -1))
+        self.revision = 0  # Goes up whenever an entity is added, removed or moves.
+
+    def __len__(self):
+        return int(self.alive.sum())
+
+    def sprite_id(self, file: str) -> int:
+        """
+        Returns the id used for a sprite file, registering it if it's new.
+        """
+        if file not in self._sprite_ids:
+            self._sprite_ids[file] = len(self.sprites)
+            self.sprites.append(file)
+        return self._sprite_ids[file]
+
+    def spawn(self, position: Vector3, file: str, scale: float, radius: float = 0.5, velocity: Vector3 = None) -> int:
+        """
+        Adds a new entity.
+        :param position: Where the entity starts.
+        :param file: The .tur file the entity is drawn with.
+        :param scale: How big the sprite is drawn.
+        :param radius: Radius of the entity's collision sphere.
+        :param velocity: How far the entity moves per tick.
+        :return: The new entity's id.
+        """
+        if not self._free:
+            self._grow()
+        i = self._free.pop()
+        self.position[i] = (position.x, position.y, position.z)
+        if velocity is None:
+            self.velocity[i] = 0
+        else:
+            self.velocity[i] = (velocity.x, velocity.y, velocity.z)
+        self.radius[i] = radius
+        self.sprite[i] = self.sprite_id(file)
+        self.scale[i] = scale
+        self.alive[i] = True
+        self.revision += 1
+        return i
+
+    def remove(self, i: int):
+        """
+        Removes an entity, its id may be given to a later spawn.
+        """
+        if self.alive[i]:
+            self.alive[i] = False
+            self._free.append(i)
+            self.revision += 1
+
+    def _grow(self):
+        old = len(self.alive)
+        new = old * 2 if old else 64
+        for name in ("position", "velocity"):
+            array = np.zeros((new, 3))
+            array[:old] = getattr(self, name)
+            setattr(self, name, array)
+        for name, dtype in (("radius", float), ("sprite", np.intp), ("scale", float), ("alive", bool)):
+            array = np.zeros(new, dtype=dtype)
+            array[:old] = getattr(self, name)
+            setattr(self, name, array)
+        self._free.extend(range(new - 1, old - 1, -1))
+
+    def update(self, ticks: float = 1, colliders: ColliderBatch = None, gravity: float = 0):
+        """
+        Moves every entity by its velocity, sliding them along the colliders they hit.
+        :param ticks: How many physics ticks to advance.
+        :param colliders: The scene's colliders, entities move freely if None.
+        :param gravity: Added to every entity's y velocity each tick.
+        """
+        rows = np.flatnonzero(self.alive)
+        if len(rows) == 0:
+            return
+        self.velocity[rows, 1] += gravity * ticks
+        displacement = self.velocity[rows] * ticks
+        if colliders is not None and len(colliders):
+            displacement = self._slide(rows, displacement, colliders)
+        if displacement.any():
+            self.position[rows] += displacement
+            self.revision += 1
+
+    def _slide(self, rows: np.ndarray, displacement: np.ndarray, colliders: ColliderBatch,
+               iterations: int = 3) -> np.ndarray:
+        """
+        ColliderBatch.slide for every entity at once: each sweep moves the entities up to what they hit,
+        then the rest of their movement, minus the part going into the surface, is swept again.
+        Velocity going into a surface that was hit is stopped.
+        :return: How far each entity can move.
+        """
+        position = self.position[rows]
+        radius = self.radius[rows]
+        moved = np.zeros_like(displacement)
+        remaining = displacement.copy()
+        active = np.arange(len(rows))
+        for i in range(iterations):
+            length = np.sqrt((remaining[active] ** 2).sum(axis=1))
+            active = active[length > 0]
+            length = length[length > 0]
+            if len(active) == 0:
+                break
+            toi, indices, normals = colliders.sweep_arrays(position[active] + moved[active], radius[active],
+                                                           remaining[active])
+            hit = indices >= 0
+            free = active[~hit]
+            moved[free] += remaining[free]
+            active = active[hit]
+            normals = normals[hit]
+            t = np.maximum(toi[hit] - SKIN / length[hit], 0)[:, None]
+            moved[active] += remaining[active] * t
+            # Remove the part of the remaining movement going into the surface.
+            step = remaining[active] * (1 - t)
+            into = (step * normals).sum(axis=1)
+            remaining[active] = step - normals * np.minimum(into, 0)[:, None]
+            velocity = self.velocity[rows[active]]
+            into = (velocity * normals).sum(axis=1)
+            velocity -= normals * np.minimum(into, 0)[:, None]
+            self.velocity[rows[active]] = velocity
+        return moved
+
+    def project(self, cam: Camera, cam_close: float, render_distance: float) -> list:
+        """
+        Projects every visible entity onto the screen.
+        :return: A list of (distance, SpriteDraw) tuples sorted from furthest to nearest.
+        """
+        rows = np.flatnonzero(self.alive)
+        if len(rows) == 0:
+            return []
+        camera = np.array((cam.position.x, cam.position.y, cam.position.z))
+        relative = self.position[rows] - camera
+        distance = np.sqrt((relative ** 2).sum(axis=1))
+        # Rotate into camera space, the same as Vector3.rotate_around with -y_rotation.
+        s = math.sin(-cam.y_rotation * (math.pi / 180))
+        c = math.cos(-cam.y_rotation * (math.pi / 180))
+        x = relative[:, 0] * c - relative[:, 2] * s
+        y = relative[:, 1]
+        z = relative[:, 0] * s + relative[:, 2] * c
+        visible = np.flatnonzero((z > cam_close) & (distance < render_distance))
+        visible = visible[np.argsort(-distance[visible], kind="stable")]
+        z = z[visible]
+        screen_x = x[visible] / z
+        screen_y = y[visible] / z
+        size = self.scale[rows[visible]] / z
+        sprites = self.sprite[rows[visible]]
+        return [(d, SpriteDraw(self.sprites[i], sx, sy, sz))
+                for d, i, sx, sy, sz in zip(distance[visible].tolist(), sprites.tolist(), screen_x.tolist(),
+                                            screen_y.tolist(), size.tolist())]
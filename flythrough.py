@@ -0,0 +1,162 @@
+import os
+import time
+import argparse
+import multiprocessing
+from dataclasses import dataclass
+from renderer import *
+from game_objects import *
+from game import create_file_object
+from framebuffer import FrameBuffer
+
+"""
+Renders a flythrough of a scene along a camera path to numbered image files, without a window.
+Frames are shared out over a pool of processes which each load the scene once.
+
+A camera path file has one keyframe per line:
+k <time> <x> <y> <z> <y rotation> [zoom]
+"""
+
+
+@dataclass
+class Keyframe:
+    time: float
+    position: Vector3
+    y_rotation: float
+    zoom: float = 1
+
+
+class CameraPath:
+    """
+    Keyframes sorted by time, positions are smoothed with a Catmull-Rom spline.
+    """
+    def __init__(self, keyframes: list, smooth: bool = True):
+        if not keyframes:
+            raise Exception("camera path has no keyframes")
+        self.keyframes = sorted(keyframes, key=lambda k: k.time)
+        self.smooth = smooth
+
+    @property
+    def duration(self) -> float:
+        return self.keyframes[-1].time - self.keyframes[0].time
+
+    def camera_at(self, t: float) -> Camera:
+        """
+        Finds where the camera is at a time along the path.
+        """
+        keys = self.keyframes
+        t = min(max(t, keys[0].time), keys[-1].time)
+        i = 0
+        while i < len(keys) - 2 and keys[i + 1].time <= t:
+            i += 1
+        if len(keys) == 1:
+            k = keys[0]
+            return Camera(k.position.other(), k.y_rotation, k.zoom, [0, 0, 0], 0)
+
+        k1 = keys[i]
+        k2 = keys[i + 1]
+        span = k2.time - k1.time
+        f = (t - k1.time) / span if span > 0 else 0
+        if self.smooth:
+            k0 = keys[max(i - 1, 0)]
+            k3 = keys[min(i + 2, len(keys) - 1)]
+            position = catmull_rom(k0.position, k1.position, k2.position, k3.position, f)
+        else:
+            position = k1.position + (k2.position - k1.position).scale(f)
+        rotation = k1.y_rotation + (k2.y_rotation - k1.y_rotation) * f
+        zoom = k1.zoom + (k2.zoom - k1.zoom) * f
+        return Camera(position, rotation, zoom, [0, 0, 0], 0)
+
+
+def catmull_rom(p0: Vector3, p1: Vector3, p2: Vector3, p3: Vector3, f: float) -> Vector3:
+    """
+    Interpolates between p1 and p2 with a curve that also passes through its neighbours.
+    """
+    f2 = f * f
+    f3 = f2 * f
+    return (p1.scale(2) + (p2 - p0).scale(f) + (p0.scale(2) - p1.scale(5) + p2.scale(4) - p3).scale(f2) +
+            (p1.scale(3) - p0 - p2.scale(3) + p3).scale(f3)).scale(0.5)
+
+
+def load_path(filename: str, smooth: bool = True) -> CameraPath:
+    """
+    Reads a camera path file.
+    """
+    keyframes = []
+    with open(filename) as file:
+        for line in file:
+            split = line.split()
+            if split and split[0] == "k":
+                zoom = float(split[6]) if len(split) > 6 else 1
+                keyframes.append(Keyframe(float(split[1]), Vector3(float(split[2]), float(split[3]), float(split[4])),
+                                          float(split[5]), zoom))
+    return CameraPath(keyframes, smooth)
+
+
+# Set up once in each worker process by _load_scene.
+_SCENE = None
+
+
+def _load_scene(scene: str, width: int, height: int, out_dir: str, extension: str):
+    global _SCENE
+    items, colliders = create_file_object(scene)
+    t = FrameBuffer(width, height)
+    init(t)
+    _SCENE = (items, t, out_dir, extension)
+
+
+def _render_frame(job: tuple) -> str:
+    index, cam = job
+    items, t, out_dir, extension = _SCENE
+    render(cam, items, t)
+    path = os.path.join(out_dir, "frame_%05d.%s" % (index, extension))
+    t.save(path)
+    return path
+
+
+def render_path(scene: str, path: CameraPath, out_dir: str, fps: float = 24, width: int = 320, height: int = 240,
+                extension: str = "png", processes: int = None):
+    """
+    Renders every frame of a camera path to numbered files.
+    :param scene: The .obj file to load from Objects/.
+    :param path: Where the camera goes.
+    :param out_dir: Folder to write frames to, it's created if needed.
+    :param fps: Frames per second of path time.
+    :param processes: How many worker processes to use, defaults to one per core.
+    :return: Yields each written file as it's finished, not necessarily in order.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    count = int(path.duration * fps) + 1
+    start = path.keyframes[0].time
+    jobs = [(i, path.camera_at(start + i / fps)) for i in range(count)]
+    with multiprocessing.Pool(processes, _load_scene, (scene, width, height, out_dir, extension)) as pool:
+        # Small chunks keep the cores busy when some frames take longer than others.
+        chunk = max(1, count // ((processes or os.cpu_count() or 1) * 8))
+        for written in pool.imap_unordered(_render_frame, jobs, chunk):
+            yield written
+
+
+def main(args: list = None):
+    parser = argparse.ArgumentParser(description="Renders a flythrough of a scene to image files.")
+    parser.add_argument("scene", help="name of the .obj file in Objects/")
+    parser.add_argument("path", help="camera path file")
+    parser.add_argument("out_dir", help="folder to write frames to")
+    parser.add_argument("--fps", type=float, default=24)
+    parser.add_argument("--size", default="320x240", help="frame size, WIDTHxHEIGHT")
+    parser.add_argument("--format", default="png", choices=("png", "ppm"))
+    parser.add_argument("--processes", type=int, default=None, help="worker processes, one per core by default")
+    parser.add_argument("--linear", action="store_true", help="move in straight lines between keyframes")
+    options = parser.parse_args(args)
+    width, height = (int(n) for n in options.size.split("x"))
+
+    path = load_path(options.path, not options.linear)
+    start = time.perf_counter()
+    frames = 0
+    for written in render_path(options.scene, path, options.out_dir, options.fps, width, height, options.format,
+                               options.processes):
+        frames += 1
+    elapsed = time.perf_counter() - start
+    print("%d frames in %.1f s (%.1f frames/s)" % (frames, elapsed, frames / elapsed))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+import math
+import struct
+import zlib
+import numpy as np
+
+"""
+A headless drawing backend that understands the turtle commands the renderer uses and draws them into
+a pixel buffer instead of a window. Frames can be saved as .ppm or .png files.
+"""
+
+
+def to_bytes(color) -> bytes:
+    """
+    Turns a turtle color tuple (0 to 1 floats) into 3 bytes.
+    """
+    return bytes(min(255, max(0, int(c * 255 + 0.5))) for c in color[:3])
+
+
+class FrameBuffer:
+    """
+    Stands in for a Turtle (and its screen) when rendering without a window.
+    """
+    def __init__(self, width: int = 320, height: int = 240, background: tuple = (1, 1, 1), atlas: bool = True):
+        """
+        :param atlas: Draw sprites by copying bitmaps from the shared sprite atlas instead of following their commands.
+        """
+        self.width = width
+        self.height = height
+        self.background = to_bytes(background)
+        self.pixels = bytearray(self.background * (width * height))
+        self._rows = np.frombuffer(self.pixels, dtype=np.uint8).reshape(height, width, 3)
+        self.screen = self  # render() talks to t.screen like it would for a real turtle.
+        self.world = (-1, -1, 1, 1)
+        self.x = 0.0
+        self.y = 0.0
+        self.heading = 0.0
+        self.pen_down = False
+        self.filling = False
+        self.fill_path = []
+        self.fill = self.background
+        self.pen = b"\x00\x00\x00"
+        self.atlas = None
+        if atlas:
+            from sprite_atlas import shared_atlas
+            self.atlas = shared_atlas()
+
+    # Screen methods.
+    def setworldcoordinates(self, llx: float, lly: float, urx: float, ury: float):
+        self.world = (llx, lly, urx, ury)
+
+    def tracer(self, *args):
+        pass
+
+    def update(self):
+        pass
+
+    # Turtle methods.
+    def clear(self):
+        self._rows[:, :] = tuple(self.background)
+
+    def speed(self, *args):
+        pass
+
+    def hideturtle(self):
+        pass
+
+    def up(self):
+        self.pen_down = False
+
+    def down(self):
+        self.pen_down = True
+
+    def fillcolor(self, *color):
+        self.fill = to_bytes(color[0] if len(color) == 1 else color)
+
+    def pencolor(self, *color):
+        self.pen = to_bytes(color[0] if len(color) == 1 else color)
+
+    def setheading(self, angle: float):
+        self.heading = angle
+
+    def right(self, angle: float):
+        self.heading -= angle
+
+    def left(self, angle: float):
+        self.heading += angle
+
+    def goto(self, x: float, y: float):
+        if self.pen_down:
+            self.line(self.x, self.y, x, y, self.pen)
+        self.x = x
+        self.y = y
+        if self.filling:
+            self.fill_path.append((x, y))
+
+    def forward(self, distance: float):
+        angle = self.heading * (math.pi / 180)
+        self.goto(self.x + distance * math.cos(angle), self.y + distance * math.sin(angle))
+
+    def circle(self, radius: float, extent: float = None, steps: int = None):
+        """
+        Draws a circle the same way turtle does, as a polygon of short lines.
+        """
+        if extent is None:
+            extent = 360
+        if steps is None:
+            frac = abs(extent) / 360
+            steps = 1 + int(min(11 + abs(radius) / 6, 59) * frac)
+        w = extent / steps
+        w2 = 0.5 * w
+        length = 2 * radius * math.sin(w2 * (math.pi / 180))
+        if radius < 0:
+            length, w, w2 = -length, -w, -w2
+        self.left(w2)
+        for i in range(steps):
+            self.forward(length)
+            self.left(w)
+        self.right(w2)
+
+    def begin_fill(self):
+        self.filling = True
+        self.fill_path = [(self.x, self.y)]
+
+    def end_fill(self):
+        if self.filling and len(self.fill_path) > 2:
+            self.polygon([self.to_pixel(x, y) for x, y in self.fill_path], self.fill)
+        self.filling = False
+        self.fill_path = []
+
+    # Rasterizing.
+    def to_pixel(self, x: float, y: float) -> tuple:
+        llx, lly, urx, ury = self.world
+        return (x - llx) / (urx - llx) * self.width, (ury - y) / (ury - lly) * self.height
+
+    def polygon(self, points: list, color: bytes):
+        """
+        Fills a polygon given in pixel coordinates using even-odd scanlines.
+        """
+        top = max(0, int(math.ceil(min(p[1] for p in points) - 0.5)))
+        bottom = min(self.height - 1, int(math.floor(max(p[1] for p in points) - 0.5)))
+        edges = list(zip(points, points[1:] + points[:1]))
+        for row in range(top, bottom + 1):
+            y = row + 0.5
+            crossings = []
+            for (x1, y1), (x2, y2) in edges:
+                if (y1 <= y < y2) or (y2 <= y < y1):
+                    crossings.append(x1 + (y - y1) * (x2 - x1) / (y2 - y1))
+            crossings.sort()
+            start = row * self.width
+            for i in range(0, len(crossings) - 1, 2):
+                x1 = max(0, int(math.ceil(crossings[i] - 0.5)))
+                x2 = min(self.width, int(math.ceil(crossings[i + 1] - 0.5)))
+                if x2 > x1:
+                    self.pixels[(start + x1) * 3:(start + x2) * 3] = color * (x2 - x1)
+
+    def blit(self, left: int, top: int, colors: np.ndarray, mask: np.ndarray):
+        """
+        Copies the masked pixels of a (height, width, 3) bitmap with its top left corner at a pixel.
+        """
+        height, width = mask.shape
+        x1, y1 = max(0, -left), max(0, -top)
+        x2, y2 = min(width, self.width - left), min(height, self.height - top)
+        if x2 <= x1 or y2 <= y1:
+            return
+        np.copyto(self._rows[top + y1:top + y2, left + x1:left + x2], colors[y1:y2, x1:x2],
+                  where=mask[y1:y2, x1:x2, None])
+
+    def line(self, x1: float, y1: float, x2: float, y2: float, color: bytes):
+        """
+        Draws a one pixel wide line between two points in world coordinates.
+        """
+        x1, y1 = self.to_pixel(x1, y1)
+        x2, y2 = self.to_pixel(x2, y2)
+        steps = int(max(abs(x2 - x1), abs(y2 - y1))) + 1
+        if steps > 4 * (self.width + self.height):
+            return  # Points far outside the screen, don't walk the whole line.
+        if steps > 16:
+            # Long lines are stepped all at once, the same steps as the loop below.
+            i = np.arange(steps + 1)
+            x = (x1 + (x2 - x1) * i / steps).astype(int)
+            y = (y1 + (y2 - y1) * i / steps).astype(int)
+            inside = (0 <= x) & (x < self.width) & (0 <= y) & (y < self.height)
+            self._rows[y[inside], x[inside]] = tuple(color)
+            return
+        for i in range(steps + 1):
+            x = int(x1 + (x2 - x1) * i / steps)
+            y = int(y1 + (y2 - y1) * i / steps)
+            if 0 <= x < self.width and 0 <= y < self.height:
+                index = (y * self.width + x) * 3
+                self.pixels[index:index + 3] = color
+
+    # Saving.
+    def save(self, path: str):
+        """
+        Writes the frame to a .png file, or a .ppm file for any other extension.
+        """
+        with open(path, "wb") as file:
+            if path.lower().endswith(".png"):
+                file.write(self.png())
+            else:
+                file.write(self.ppm())
+
+    def ppm(self) -> bytes:
+        return b"P6 %d %d 255\n" % (self.width, self.height) + bytes(self.pixels)
+
+    def png(self) -> bytes:
+        def chunk(kind: bytes, data: bytes) -> bytes:
+            return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xffffffff)
+
+        stride = self.width * 3
+        raw = b"".join(b"\x00" + bytes(self.pixels[row * stride:(row + 1) * stride]) for row in range(self.height))
+        return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", self.width, self.height, 8, 2, 0, 0, 0))
+                + chunk(b"IDAT", zlib.compress(raw, 6)) + chunk(b"IEND", b""))
@@ -1,9 +1,16 @@
 import time
-import keyboard
+import argparse
 from renderer import *
 from game_objects import *
+from quality import QualityController, print_decision
+from collision import ColliderBatch
+from entities import EntityStore
+from inputs import LiveInput, open_input
+from loader import AssetCache, AssetLoader, build_object, shared_executor
 
 GRAVITY = -0.01
+TICK_RATE = 50  # Physics ticks per second.
+MAX_TICKS = 5  # Most ticks a single slow frame can catch up on.
 
 """
 This Program launches and runs the game.
@@ -19,177 +26,168 @@ def create_file_object(filename: str, position: Vector3 = Vector3(0,0,0), y_rota
     :param scale: How big you want the object to be.
     :return: A list of the objects polygons for rendering.
     """
-    with open("Objects/" + filename + ".obj") as file:
-        color = (1, 1, 1)
-        vectors = []
-        polygons = []
-        colliders = []
-        for line in file:
-            stripped = line.strip()
-            split = line.split(" ")
-            # Turns all the previous points into a new polygon.
-            if (stripped == "" and len(vectors) > 1) or stripped == "end":
-                poly = Polygon(vectors, Vector3(0, 0, 0), color)
-                poly.instantiate()
-                polygons.append(poly)
-                vectors = []
-            # Sets a point for a polygon.
-            elif split[0] == "v":
-                vec = Vector3(scale.x * float(split[1]), scale.y * float(split[2]), scale.z * float(split[3]))
-                vec += position
-                vectors.append(vec.rotate_around(position, Vector3(0, y_rotation, 0)))
-            # Sets the next polygons' color.
-            elif split[0] == "c":
-                color = (float(split[1]), float(split[2]), float(split[3]))
-            # Creates a Wall Collider.
-            elif split[0] == "wcol":
-                pos = Vector3(scale.x * float(split[1]), scale.y * float(split[2]), scale.z * float(split[3]))
-                pos += position
-                colliders.append(WallCollider(pos.rotate_around(position, Vector3(0, y_rotation, 0)),
-                                              float(split[4]) - y_rotation,
-                                              (scale.z * (0.5 * math.cos(float(split[4]) * (math.pi/180)) + 0.5) +
-                                               scale.x * (0.5 * -math.cos(float(split[4]) * (math.pi/180)) + 0.5)) * float(split[5]),
-                                              scale.y * float(split[6])))
-            # Creates a Slope Collider.
-            elif split[0] == "rcol":
-                pos = Vector3(scale.x * float(split[1]), scale.y * float(split[2]), scale.z * float(split[3]))
-                pos += position
-                colliders.append(SlopeCollider(pos.rotate_around(position, Vector3(0, y_rotation, 0)),
-                                               float(split[4]) - y_rotation, scale.x * float(split[5]),
-                                               scale.z * float(split[6]), (scale.y / scale.z) * float(split[7])))
-            # Creates a Sphere Collider.
-            elif split[0] == "scol":
-                pos = Vector3(scale.x * float(split[1]), scale.y * float(split[2]), scale.z * float(split[3]))
-                pos += position
-                colliders.append(SphereCollider(pos.rotate_around(position, Vector3(0, y_rotation, 0)), 0, float(split[4])))
-            # Creates a Platform Collider
-            elif split[0] == "pcol":
-                pos = Vector3(scale.x * float(split[1]), scale.y * float(split[2]), scale.z * float(split[3]))
-                pos += position
-                colliders.append(PlaneCollider(pos.rotate_around(position, Vector3(0, y_rotation, 0)),
-                                               float(split[4]) - y_rotation, scale.x * float(split[5]),
-                                               scale.z * float(split[6])))
-            # Loads another object from a file.
-            elif split[0] == "file":    # file <name> <position> <yrotation> <scale>
-                pos = Vector3(scale.x * float(split[2]), scale.y * float(split[3]), scale.z * float(split[4]))
-                pos += position
-                newscale = Vector3(scale.x * float(split[6]), scale.y * float(split[7]), scale.z * float(split[8]))
-                poly, collide = create_file_object(split[1], pos.rotate_around(position, Vector3(0, y_rotation, 0)),
-                                                   float(split[5]) + y_rotation, newscale)
-                polygons.extend(poly)
-                colliders.extend(collide)
-            # Loads another sprite from a file.
-            elif split[0] == "sprite":    # sprite <name> <position> <scale>
-                pos = Vector3(scale.x * float(split[2]), scale.y * float(split[3]), scale.z * float(split[4]))
-                pos += position
-                newscale = float(split[5]) * max(scale.x, scale.y, scale.z)
-                polygons.append(Sprite(pos, split[1], newscale))
-
-    return polygons, colliders
-
-
-def controls(cam: Camera, ground: SphereCollider, wall: SphereCollider, colliders):
+    files = AssetCache(shared_executor()).load_tree(filename)
+    return build_object(files, filename, position, y_rotation, scale)
+
+
+def controls(cam: Camera, ground: SphereCollider, wall: SphereCollider, colliders: ColliderBatch, ticks: float = 1,
+             keys=None) -> int:
     """
     Allows user to press keyboard buttons to move and rotate the camera around the virtual world.
     This function also simulates player gravity and collision.
     :param cam: The location, rotation, and all other information of the camera.
     :param ground: Collider that detects the ground.
     :param wall: Collider that detects walls.
+    :param colliders: The scene's colliders, packed for batched overlap tests.
+    :param ticks: How many physics ticks this step covers, movement is swept so large steps can't pass through colliders.
+        Steps longer than a tick are integrated in steps of at most one tick.
+    :param keys: Where key presses come from, the live keyboard if None.
+    :return: 1 if the player asked to quit, 0 otherwise.
     """
+    if keys is None:
+        keys = LiveInput()
     move_fb = 0
     move_ss = 0
-    move_ud = 0
     rotation = 0
     multiply = 1
-    if keyboard.is_pressed("shift"):
+    if keys.is_pressed("shift"):
         multiply = 1.5
-    if keyboard.is_pressed("w"):
+    if keys.is_pressed("w"):
         move_fb += 0.1
-    if keyboard.is_pressed("s"):
+    if keys.is_pressed("s"):
         move_fb -= 0.1
-    if keyboard.is_pressed("a"):
+    if keys.is_pressed("a"):
         move_ss += 0.1
-    if keyboard.is_pressed("d"):
+    if keys.is_pressed("d"):
         move_ss -= 0.1
-    if keyboard.is_pressed("left arrow"):
+    if keys.is_pressed("left arrow"):
         rotation += 4
-    if keyboard.is_pressed("right arrow"):
+    if keys.is_pressed("right arrow"):
         rotation -= 4
-    if keyboard.is_pressed("escape"):
+    if keys.is_pressed("escape"):
         return 1
 
     ground.position = cam.position + Vector3(0, -1.5, 0)
     wall.position = cam.position + Vector3(0, -1.3, 0)
-    colliders.sort(key=lambda x: ground.overlap(x), reverse=True)
-
-    col = ground.is_colliding(colliders)
-    if col is None:
-        move_ud = GRAVITY
-    elif type(col) != WallCollider:
-        cam.acceleration[2] = ground.overlap(col) / 2
-        move_ud = 0
-
-    cam.acceleration[0] = (cam.acceleration[0] + move_fb * 0.15) / 1.15
-    cam.acceleration[1] = (cam.acceleration[1] + move_ss * 0.15) / 1.15
-    cam.acceleration[2] += move_ud
-    cam.angular_acceleration = (cam.angular_acceleration + rotation*0.2)/1.2
-
-    cam.position += (cam.forward().scale(cam.acceleration[0]) +
+    depth, col = colliders.deepest(ground)
+
+    # Velocity, damping and gravity change every tick, so a long step is integrated a tick at a time
+    # and then swept as one movement.
+    steps = max(1, math.ceil(ticks))
+    step = ticks / steps
+    movement = Vector3(0, 0, 0)
+    for i in range(steps):
+        if col is None:
+            cam.acceleration[2] += GRAVITY * step
+        elif type(col) != WallCollider:
+            # Pushed out of the ground by half of how deep the player still is each tick.
+            cam.acceleration[2] = depth / 2
+            depth -= cam.acceleration[2] * step
+        cam.acceleration[0] = (cam.acceleration[0] + move_fb * 0.15 * step) / 1.15 ** step
+        cam.acceleration[1] = (cam.acceleration[1] + move_ss * 0.15 * step) / 1.15 ** step
+        cam.angular_acceleration = (cam.angular_acceleration + rotation * 0.2 * step) / 1.2 ** step
+
+        movement += (cam.forward().scale(cam.acceleration[0]) +
                      cam.forward().rotate_around(Vector3(0, 0, 0), Vector3(0, 90, 0)).scale(cam.acceleration[1]) +
-                     Vector3(0, 1, 0).scale(cam.acceleration[2])).scale(multiply)
-    cam.y_rotation += cam.angular_acceleration
+                     Vector3(0, 1, 0).scale(cam.acceleration[2])).scale(multiply * step)
+        cam.y_rotation += cam.angular_acceleration * step
+
+    movement = colliders.slide(wall, movement, WallCollider)
+    if movement.y < 0:
+        movement = colliders.slide(ground, movement, (PlaneCollider, SlopeCollider))
+    cam.position += movement
+    wall.position = cam.position + Vector3(0, -1.3, 0)
 
-    wall_col = wall.is_colliding(colliders)
+    depth, wall_col = colliders.deepest(wall, WallCollider)
     if type(wall_col) is WallCollider and wall.overlap(col) is not None:
         overlap = Vector3(0, 0, 1).scale(wall.overlap(wall_col))
         overlap = overlap.rotate_around(Vector3(0, 0, 0), Vector3(0, -wall_col.y_rotation, 0))
         cam.position -= overlap
 
+    return 0
+
 
-def item_setup(cam) -> list:
+def item_setup(cam) -> tuple:
     """
     Generates the scene.
     :param cam: The camera
     :param colliders: The scenes colliders
-    :return: List of polygons to be added to the render list.
+    :return: List of polygons to be added to the render list, the scene's colliders, its entities and
+             the loader still filling in the polygons and colliders in the background.
     """
     items = list()
     colliders = list()
-    #items.append(Sprite(Vector3(2, 4, 2), "enemy1", 0.2))
+    entities = EntityStore()
+    #entities.spawn(Vector3(2, 4, 2), "enemy1", 0.2)
 
-    poly, collide = create_file_object("map1", Vector3(0, 0, 0), 0, Vector3(1, 1, 1))
-    items.extend(poly)
-    colliders.extend(collide)
+    loader = AssetLoader("map1", Vector3(0, 0, 0), 0, Vector3(1, 1, 1))
 
-    return items, colliders
+    return items, colliders, entities, loader
 
 
-def main():
+def main(args: list = None):
     """
     Sets up world, displays world and allows you to move camera around world.
+    :param args: Command line options, --record or --replay a file of key presses.
     """
+    parser = argparse.ArgumentParser(description="Runs the game.")
+    parser.add_argument("--record", help="record key presses to this file")
+    parser.add_argument("--replay", help="replay key presses from this file instead of the keyboard")
+    options = parser.parse_args(args)
+    keys = open_input(options.record, options.replay)
+
     cam = Camera(Vector3(0, 7, -3), -89, 1, [0,0,0], 0)
     ground = SphereCollider(cam.position + Vector3(0, -1.5, 0), 0, 0.4)
     wall = SphereCollider(cam.position + Vector3(0, -1.3, 0), 0, 0.5)
 
-    items, colliders = item_setup(cam)
+    items, collider_list, entities, loader = item_setup(cam)
+    colliders = ColliderBatch(collider_list)
     turtle1 = Turtle()
     turtle2 = Turtle()
     init(turtle1)
     init(turtle2)
 
+    quality = QualityController(report=print_decision)
+
     i = 0
-    while True:
-        if i % 2 == 0:
-            t = turtle1
-        else:
-            t = turtle2
-        i += 1
+    end = 0
+    last_tick = time.perf_counter()
+    frame = FrameState()
+    while end == 0:
+        quality.begin_frame()
+        # Add any of the map that finished loading.
+        if loader is not None:
+            for poly, collide in loader.poll():
+                items.extend(poly)
+                collider_list.extend(collide)
+                colliders = ColliderBatch(collider_list)
+                frame.scene_changed()
+            if loader.done:
+                if loader.error is not None:
+                    raise loader.error
+                loader = None
         # Controls
-        controls(cam, ground, wall, colliders)
-        # Visuals
-        render(cam, items, t)
+        now = time.perf_counter()
+        ticks = min((now - last_tick) * TICK_RATE, MAX_TICKS)
+        last_tick = now
+        # Physics waits for the whole map so the player can't fall through floors that haven't loaded yet.
+        if loader is None:
+            ticks = keys.tick(ticks)
+            end = controls(cam, ground, wall, colliders, ticks, keys)
+            entities.update(ticks, colliders, GRAVITY)
+        # Visuals, only redrawn when something on screen changed.
+        if frame.needs_render(cam, quality.settings, entities):
+            if i % 2 == 0:
+                t = turtle1
+            else:
+                t = turtle2
+            i += 1
+            render(cam, items, t, quality.settings, entities)
+            quality.end_frame()
+        else:
+            turtle1.screen.update()
         time.sleep(0.02)
+    keys.close()
 
 
 if __name__ == "__main__":
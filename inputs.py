@@ -0,0 +1,118 @@
+import struct
+
+"""
+Sources of keyboard input for the game and editor. Input can come from the real keyboard, be recorded
+to a file while playing, or be replayed from a file so a session runs the same way every time.
+"""
+
+KEYS = ("shift", "w", "s", "a", "d", "e", "q", "left arrow", "right arrow", "escape", "1", "2", "space", "backspace")
+MAGIC = b"TICKS1\n"
+RECORD = struct.Struct("<Id")  # Pressed keys as bits, then how many physics ticks the step covered.
+
+
+class LiveInput:
+    """
+    Reads the real keyboard, needs the keyboard package (and root on Linux).
+    """
+    def __init__(self):
+        import keyboard
+        self._keyboard = keyboard
+
+    def tick(self, ticks: float = 1) -> float:
+        """
+        Called once per step before the controls read any keys.
+        :param ticks: How many physics ticks the step covers.
+        :return: The ticks to simulate.
+        """
+        return ticks
+
+    def is_pressed(self, key: str) -> bool:
+        return self._keyboard.is_pressed(key)
+
+    def close(self):
+        pass
+
+
+class InputRecorder:
+    """
+    Wraps another input source and writes what it reported each step to a file.
+    Keys are read once per step so the recording is exactly what the controls saw.
+    """
+    def __init__(self, source, path: str, keys: tuple = KEYS):
+        self.source = source
+        self.keys = keys
+        self._pressed = set()
+        self._file = open(path, "wb")
+        self._file.write(MAGIC + (",".join(keys) + "\n").encode())
+
+    def tick(self, ticks: float = 1) -> float:
+        ticks = self.source.tick(ticks)
+        mask = 0
+        self._pressed = set()
+        for bit, key in enumerate(self.keys):
+            if self.source.is_pressed(key):
+                mask |= 1 << bit
+                self._pressed.add(key)
+        self._file.write(RECORD.pack(mask, ticks))
+        return ticks
+
+    def is_pressed(self, key: str) -> bool:
+        return key in self._pressed
+
+    def close(self):
+        self._file.close()
+        self.source.close()
+
+
+class ReplayInput:
+    """
+    Plays back a file written by InputRecorder, one record per step.
+    Once the recording runs out escape is held so the game loop ends.
+    """
+    def __init__(self, path: str):
+        with open(path, "rb") as file:
+            if file.readline() != MAGIC:
+                raise Exception(path + " is not an input recording")
+            self.keys = tuple(file.readline().decode().rstrip("\n").split(","))
+            data = file.read()
+        self.records = [RECORD.unpack_from(data, offset) for offset in range(0, len(data) - RECORD.size + 1, RECORD.size)]
+        self.step = 0
+        self._pressed = set()
+
+    def __len__(self):
+        return len(self.records)
+
+    @property
+    def finished(self) -> bool:
+        return self.step >= len(self.records)
+
+    def tick(self, ticks: float = 1) -> float:
+        """
+        Moves on to the next recorded step, ignoring the given ticks in favour of the recorded ones.
+        """
+        if self.finished:
+            self._pressed = {"escape"}
+            return 0
+        mask, ticks = self.records[self.step]
+        self.step += 1
+        self._pressed = {key for bit, key in enumerate(self.keys) if mask & (1 << bit)}
+        return ticks
+
+    def is_pressed(self, key: str) -> bool:
+        return key in self._pressed
+
+    def close(self):
+        pass
+
+
+def open_input(record: str = None, replay: str = None):
+    """
+    Picks an input source from command line options.
+    :param record: File to record the live keyboard to.
+    :param replay: File to replay instead of reading the keyboard.
+    """
+    if replay is not None:
+        return ReplayInput(replay)
+    if record is not None:
+        return InputRecorder(LiveInput(), record)
+    return LiveInput()
@@ -0,0 +1,423 @@
+import math
+import queue
+import numpy as np
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future, wait, FIRST_COMPLETED
+from renderer import *
+from game_objects import *
+
+"""
+Loads .obj files in two steps: every file in the include tree is read and parsed (concurrently when
+given an executor), then the parsed files are placed into the world with their positions, rotations
+and scales. AssetLoader does this in the background so a window can come up before a map is loaded.
+"""
+
+
+CHUNK_SIZE = 1 << 20  # Characters read from a file at a time.
+# Numbers each kind of line needs after its keyword (and name, for file and sprite lines).
+FIELDS = {"c": 3, "wcol": 6, "rcol": 7, "scol": 4, "pcol": 6, "file": 7, "sprite": 4}
+
+
+class ObjectFileError(Exception):
+    """
+    A line in an .obj file that can't be read.
+    """
+    def __init__(self, filename: str, line: int, message: str):
+        Exception.__init__(self, "Objects/%s.obj:%d: %s" % (filename, line, message))
+        self.filename = filename
+        self.line = line
+
+
+class ObjectFile:
+    """
+    The parsed, untransformed contents of one .obj file, kept in file order.
+    Records are ("poly", points, color) with points an (n, 3) array, (collider type, numbers),
+    ("file", name, numbers) or ("sprite", name, numbers).
+    """
+    def __init__(self, name: str, records: list):
+        self.name = name
+        self.records = records
+
+    @property
+    def includes(self) -> list:
+        return [record[1] for record in self.records if record[0] == "file"]
+
+    @property
+    def sprites(self) -> list:
+        return [record[1] for record in self.records if record[0] == "sprite"]
+
+
+def parse_object_file(filename: str) -> ObjectFile:
+    """
+    Reads an .obj file from Objects/ without placing it anywhere.
+    """
+    return ObjectFile(filename, list(iter_object_file(filename)))
+
+
+def iter_object_file(filename: str, chunk_size: int = CHUNK_SIZE):
+    """
+    Reads an .obj file from Objects/ a chunk at a time, yielding its records in file order.
+    The points of every polygon in a chunk are converted to numbers in one go.
+    A polygon ends at a blank line or an end line and needs three or more points either way. Points left
+    over at the end of the file aren't a polygon, the maps end with one as a marker.
+    Point lines can have any whitespace around the v, lines starting with # are comments.
+    :raises ObjectFileError: At the first line that can't be read.
+    """
+    color = (1, 1, 1)
+    carried = np.zeros((0, 3))  # Points of a polygon still open at the end of the last chunk.
+    number = 0  # Line number of the last line read.
+    with open("Objects/" + filename + ".obj") as file:
+        rest = ""
+        while True:
+            chunk = file.read(chunk_size)
+            if chunk:
+                text, newline, rest = (rest + chunk).rpartition("\n")
+                if not newline:
+                    continue  # No line ended in this chunk yet.
+            elif rest:
+                text, rest = rest, ""
+            else:
+                break
+            first = number + 1
+            # Points are most of a file, so they're collected in bulk and only the other lines are looked at
+            # one by one. A line's index minus the other lines before it is how many points came before it.
+            lines = text.split("\n")
+            vertices = [line[2:] for line in lines if line[:2] == "v "]
+            records = []
+            start = -len(carried)  # Where the open polygon starts in vertices.
+            other = [(index, line) for index, line in enumerate(lines) if line[:2] != "v "]
+            # Points written with other whitespace, like "  v 0 0 0" or "v\t0 0 0", are rewritten the usual way.
+            odd = False
+            for index, line in other:
+                split = line.split()
+                if split[:1] == ["v"]:
+                    lines[index] = "v " + " ".join(split[1:])
+                    odd = True
+            if odd:
+                vertices = [line[2:] for line in lines if line[:2] == "v "]
+                other = [(index, line) for index, line in enumerate(lines) if line[:2] != "v "]
+            for others, (index, line) in enumerate(other):
+                count = index - others
+                split = line.split()
+                kind = split[0] if split else ""
+                if kind.startswith("#"):
+                    continue
+                if not split or kind == "end":
+                    # Blank lines between polygons are fine, a polygon being closed needs 3 points either way.
+                    if count - start < 3 and (kind == "end" or count > start):
+                        raise line_error(filename, lines, vertices, first, index, count,
+                                         "a polygon needs 3 or more points, got %d" % (count - start))
+                    if count > start:
+                        records.append(("poly", (start, count), color))
+                        start = count
+                elif kind in FIELDS:
+                    named = kind in ("file", "sprite")
+                    if len(split) != FIELDS[kind] + 1 + named:
+                        raise line_error(filename, lines, vertices, first, index, count,
+                                         "%s needs %s%d numbers, got: %s"
+                                         % (kind, "a name and " if named else "", FIELDS[kind], line.strip()))
+                    try:
+                        n = tuple(float(field) for field in split[1 + named:])
+                        if not all(math.isfinite(field) for field in n):
+                            raise ValueError()
+                    except ValueError:
+                        raise line_error(filename, lines, vertices, first, index, count,
+                                         "bad number in: " + line.strip())
+                    if kind == "c":
+                        color = n
+                    elif named:
+                        records.append((kind, split[1], n))
+                    else:
+                        records.append((kind, n))
+                else:
+                    raise line_error(filename, lines, vertices, first, index, count,
+                                     "unknown line: " + line.strip())
+            number = first + len(lines) - 1
+
+            points = np.concatenate((carried, parse_points(filename, lines, vertices, first)))
+            offset = len(carried)
+            for record in records:
+                if record[0] == "poly":
+                    begin, stop = record[1]
+                    yield "poly", points[offset + begin:offset + stop], record[2]
+                else:
+                    yield record
+            carried = points[offset + start:]
+
+
+def line_error(filename: str, lines: list, vertices: list, first: int, index: int, count: int,
+               message: str) -> ObjectFileError:
+    """
+    The error for a chunk's line [index], unless a point before it is bad, then that's the first error.
+    :param count: How many of the chunk's points come before the line.
+    """
+    parse_points(filename, lines[:index], vertices[:count], first)
+    return ObjectFileError(filename, first + index, message)
+
+
+def parse_points(filename: str, lines: list, vertices: list, first: int) -> np.ndarray:
+    """
+    Turns the numbers of a chunk's "v x y z" lines into an (n, 3) array.
+    :param lines: All of the chunk's lines, to find the line number of a bad point.
+    :param first: The line number of the chunk's first line.
+    """
+    if not vertices:
+        return np.zeros((0, 3))
+    try:
+        # Every row has to have as many columns as the first, so 3 columns there means 3 everywhere.
+        # Empty rows are skipped rather than rejected, so they show up as missing points.
+        points = np.loadtxt(vertices, comments=None, ndmin=2)
+        if points.shape[1] == 3 and len(points) == len(vertices) and np.isfinite(points).all():
+            return points
+    except ValueError:
+        pass
+    # Something in the chunk is wrong, go through it line by line to say where.
+    for i, line in enumerate(lines):
+        split = line.split()
+        if split and split[0] == "v":
+            try:
+                if len(split) != 4 or not all(math.isfinite(float(field)) for field in split[1:]):
+                    raise ValueError()
+            except ValueError:
+                raise ObjectFileError(filename, first + i, "v needs 3 finite numbers, got: " + line.strip())
+    raise ObjectFileError(filename, first, "couldn't read the points in this chunk")
+
+
+def build_object(files: dict, filename: str, position: Vector3 = Vector3(0, 0, 0), y_rotation: float = 0,
+                 scale: Vector3 = Vector3(1, 1, 1)) -> tuple:
+    """
+    Places a parsed object and everything it includes into the world.
+    :param files: Parsed files by name, must include every file in the include tree.
+    :param filename: The object to place.
+    :return: A list of the objects polygons for rendering and a list of its colliders.
+    """
+    polygons = []
+    colliders = []
+    rotation = Vector3(0, y_rotation, 0)
+    for record in files[filename].records:
+        kind = record[0]
+        if kind == "poly":
+            vectors = []
+            for x, y, z in record[1].tolist():
+                vec = Vector3(scale.x * x, scale.y * y, scale.z * z)
+                vec += position
+                vectors.append(vec.rotate_around(position, rotation))
+            poly = Polygon(vectors, Vector3(0, 0, 0), record[2])
+            poly.instantiate()
+            polygons.append(poly)
+        elif kind == "file":    # file <name> <position> <yrotation> <scale>
+            n = record[2]
+            pos = Vector3(scale.x * n[0], scale.y * n[1], scale.z * n[2])
+            pos += position
+            newscale = Vector3(scale.x * n[4], scale.y * n[5], scale.z * n[6])
+            poly, collide = build_object(files, record[1], pos.rotate_around(position, rotation),
+                                         n[3] + y_rotation, newscale)
+            polygons.extend(poly)
+            colliders.extend(collide)
+        elif kind == "sprite":    # sprite <name> <position> <scale>
+            n = record[2]
+            pos = Vector3(scale.x * n[0], scale.y * n[1], scale.z * n[2])
+            pos += position
+            polygons.append(Sprite(pos, record[1], n[3] * max(scale.x, scale.y, scale.z)))
+        else:
+            colliders.append(build_collider(kind, record[1], position, y_rotation, scale))
+    return polygons, colliders
+
+
+def build_collider(kind: str, n: tuple, position: Vector3, y_rotation: float, scale: Vector3):
+    """
+    Places a collider from an .obj file into the world.
+    """
+    pos = Vector3(scale.x * n[0], scale.y * n[1], scale.z * n[2])
+    pos += position
+    pos = pos.rotate_around(position, Vector3(0, y_rotation, 0))
+    # Creates a Wall Collider.
+    if kind == "wcol":
+        return WallCollider(pos, n[3] - y_rotation,
+                            (scale.z * (0.5 * math.cos(n[3] * (math.pi/180)) + 0.5) +
+                             scale.x * (0.5 * -math.cos(n[3] * (math.pi/180)) + 0.5)) * n[4],
+                            scale.y * n[5])
+    # Creates a Slope Collider.
+    if kind == "rcol":
+        return SlopeCollider(pos, n[3] - y_rotation, scale.x * n[4], scale.z * n[5], (scale.y / scale.z) * n[6])
+    # Creates a Sphere Collider.
+    if kind == "scol":
+        return SphereCollider(pos, 0, n[3])
+    # Creates a Platform Collider
+    return PlaneCollider(pos, n[3] - y_rotation, scale.x * n[4], scale.z * n[5])
+
+
+class AssetCache:
+    """
+    Parses each file once, handing the work to an executor when one is given.
+    """
+    def __init__(self, executor=None):
+        self.executor = executor
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def parse(self, filename: str) -> Future:
+        """
+        Starts parsing a file if it hasn't been already. With an executor, the files it includes
+        are started as soon as it's parsed, so the whole tree loads at once.
+        """
+        created = False
+        with self._lock:
+            future = self._futures.get(filename)
+            if future is None:
+                created = True
+                if self.executor is None:
+                    future = Future()
+                    try:
+                        future.set_result(parse_object_file(filename))
+                    except Exception as e:
+                        future.set_exception(e)
+                else:
+                    future = self.executor.submit(parse_object_file, filename)
+                self._futures[filename] = future
+        if created and self.executor is not None:
+            future.add_done_callback(self._parsed)
+        return future
+
+    def _parsed(self, future: Future):
+        if future.exception() is None:
+            parsed = future.result()
+            for include in parsed.includes:
+                self.parse(include)
+            for sprite in parsed.sprites:
+                self.executor.submit(load_sprite, sprite)
+
+    def parsed_tree(self, filename: str) -> tuple:
+        """
+        The files of a tree parsed so far, without waiting for the rest.
+        :return: (parsed files by name, futures of files still being parsed), the tree is all there when
+                 there are no futures left.
+        """
+        files = {}
+        waiting = []
+        seen = set()
+        stack = [filename]
+        while stack:
+            name = stack.pop()
+            if name in seen:
+                continue
+            seen.add(name)
+            future = self.parse(name)
+            if not future.done():
+                waiting.append(future)
+                continue
+            files[name] = future.result()
+            stack.extend(files[name].includes)
+        return files, waiting
+
+    def load_tree(self, filename: str) -> dict:
+        """
+        Parses a file and everything it includes. Includes are queued as soon as the file naming
+        them is parsed, so sibling files are read at the same time.
+        :return: Parsed files by name.
+        """
+        files = {}
+        pending = {filename: self.parse(filename)}
+        while pending:
+            wait(list(pending.values()), return_when=FIRST_COMPLETED)
+            for name, future in list(pending.items()):
+                if not future.done():
+                    continue
+                del pending[name]
+                parsed = future.result()
+                files[name] = parsed
+                for include in parsed.includes:
+                    if include not in files and include not in pending:
+                        pending[include] = self.parse(include)
+        return files
+
+
+_EXECUTOR = None
+
+
+def shared_executor() -> ThreadPoolExecutor:
+    """
+    A thread pool shared by all loads, created the first time it's needed.
+    """
+    global _EXECUTOR
+    if _EXECUTOR is None:
+        _EXECUTOR = ThreadPoolExecutor(thread_name_prefix="loader")
+    return _EXECUTOR
+
+
+class AssetLoader:
+    """
+    Loads an object in a background thread and hands it over in pieces as they become ready:
+    the file's own polygons and colliders first, then each included object once its files are parsed.
+    """
+    def __init__(self, filename: str, position: Vector3 = Vector3(0, 0, 0), y_rotation: float = 0,
+                 scale: Vector3 = Vector3(1, 1, 1), executor=None, cache: AssetCache = None):
+        """
+        :param cache: Parsed files to share with other loaders, a new one on the executor if None.
+        """
+        self.filename = filename
+        self.error = None
+        self._cache = cache or AssetCache(executor or shared_executor())
+        self._ready = queue.Queue()
+        self._done = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(position, y_rotation, scale),
+                                        name="load-" + filename, daemon=True)
+        self._thread.start()
+
+    @property
+    def done(self) -> bool:
+        """
+        True once everything has loaded (or loading failed) and been handed over by poll().
+        """
+        return self._done.is_set() and self._ready.empty()
+
+    def poll(self) -> list:
+        """
+        Returns the (polygons, colliders) pieces that finished since the last call, never blocks.
+        """
+        pieces = []
+        while True:
+            try:
+                pieces.append(self._ready.get_nowait())
+            except queue.Empty:
+                return pieces
+
+    def wait(self) -> tuple:
+        """
+        Blocks until everything is loaded.
+        :return: All the polygons and colliders not yet taken by poll().
+        """
+        self._done.wait()
+        polygons = []
+        colliders = []
+        for poly, collide in self.poll():
+            polygons.extend(poly)
+            colliders.extend(collide)
+        if self.error is not None:
+            raise self.error
+        return polygons, colliders
+
+    def _run(self, position: Vector3, y_rotation: float, scale: Vector3):
+        try:
+            root = self._cache.parse(self.filename).result()
+            # The root's own content doesn't depend on any other file.
+            own = ObjectFile(root.name, [record for record in root.records if record[0] != "file"])
+            self._ready.put(build_object({root.name: own}, root.name, position, y_rotation, scale))
+            # Each include is placed as soon as its own tree has loaded, in whatever order they finish.
+            includes = [record for record in root.records if record[0] == "file"]
+            while includes:
+                parsing = []
+                for record in list(includes):
+                    files, waiting = self._cache.parsed_tree(record[1])
+                    if waiting:
+                        parsing.extend(waiting)
+                        continue
+                    includes.remove(record)
+                    files[root.name] = ObjectFile(root.name, [record])
+                    self._ready.put(build_object(files, root.name, position, y_rotation, scale))
+                if parsing:
+                    wait(parsing, return_when=FIRST_COMPLETED)
+        except Exception as e:
+            self.error = e
+        finally:
+            self._done.set()
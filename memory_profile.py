@@ -0,0 +1,214 @@
+import gc
+import sys
+import time
+import argparse
+import tracemalloc
+from dataclasses import dataclass, field
+from typing import Callable
+from renderer import *
+from game_objects import *
+from game import create_file_object
+from loader import AssetCache, ObjectFile, build_object, shared_executor
+from framebuffer import FrameBuffer
+
+"""
+Reports how much memory a loaded scene costs and how much the render loop allocates per frame.
+Scene memory is broken down by object type and by the .obj file the objects came from, and
+--check fails when a reference scene goes over its budget, so map growth shows up before it ships.
+"""
+
+
+@dataclass
+class MemoryBudget:
+    scene_bytes: int  # Most memory create_file_object may hold on to.
+    frame_peak_bytes: int  # Most memory a frame may have allocated at once.
+    frame_allocations: int  # Most memory blocks a frame may allocate.
+
+
+# Measured sizes with room to grow, raise them on purpose when a map is meant to get bigger.
+REFERENCE_BUDGETS = {
+    "map1": MemoryBudget(64 * 1024, 256 * 1024, 512),
+    "testing": MemoryBudget(32 * 1024, 256 * 1024, 512),
+}
+
+
+@dataclass
+class SceneProfile:
+    filename: str
+    traced_bytes: int  # Memory still allocated after loading, as tracemalloc sees it.
+    traced_blocks: int
+    by_type: dict = field(default_factory=dict)  # Type name -> [count, bytes]
+    by_file: dict = field(default_factory=dict)  # File name -> [times included, count, bytes]
+    frames: list = field(default_factory=list)  # (peak bytes, allocations, milliseconds) for each frame.
+
+    def frame_peak_bytes(self) -> int:
+        return max((frame[0] for frame in self.frames), default=0)
+
+    def frame_allocations(self) -> int:
+        return max((frame[1] for frame in self.frames), default=0)
+
+
+def object_sizes(objects: list, sizes: dict = None) -> dict:
+    """
+    Adds up the objects reachable from some objects by type, each object counted once.
+    Instance attribute dicts are counted with their instance.
+    :return: Type name -> [count, bytes]
+    """
+    if sizes is None:
+        sizes = {}
+    seen = set()
+    stack = list(objects)
+    while stack:
+        obj = stack.pop()
+        if id(obj) in seen:
+            continue
+        seen.add(id(obj))
+        entry = sizes.setdefault(type(obj).__name__, [0, 0])
+        entry[0] += 1
+        entry[1] += sys.getsizeof(obj)
+        if hasattr(obj, "__dict__"):
+            entry[1] += sys.getsizeof(obj.__dict__)
+            stack.extend(vars(obj).values())
+        elif type(obj) in (list, tuple):
+            stack.extend(obj)
+    return sizes
+
+
+def include_counts(files: dict, filename: str, counts: dict = None) -> dict:
+    """
+    How many times each file is placed in a scene.
+    """
+    if counts is None:
+        counts = {}
+    counts[filename] = counts.get(filename, 0) + 1
+    for include in files[filename].includes:
+        include_counts(files, include, counts)
+    return counts
+
+
+def frame_allocations(before: tracemalloc.Snapshot, after: tracemalloc.Snapshot) -> int:
+    """
+    How many more memory blocks each line of code has allocated in [after] than in [before], added up.
+    Lines that freed more than they allocated don't cancel out the ones that allocated.
+    """
+    ignore = [tracemalloc.Filter(False, tracemalloc.__file__)]
+    stats = after.filter_traces(ignore).compare_to(before.filter_traces(ignore), "lineno")
+    return sum(stat.count_diff for stat in stats if stat.count_diff > 0)
+
+
+def profile_scene(filename: str, frames: int = 0, width: int = 320, height: int = 240) -> SceneProfile:
+    """
+    Loads a scene with tracemalloc running and measures what it costs.
+    :param filename: The scene in Objects/.
+    :param frames: How many frames to render afterwards while measuring each one.
+    """
+    tracing = tracemalloc.is_tracing()
+    if not tracing:
+        tracemalloc.start()
+    try:
+        shared_executor()  # Its threads last the whole run, don't count them against the scene.
+        before = tracemalloc.take_snapshot()
+        items, colliders = create_file_object(filename)
+        gc.collect()  # Parsing leaves reference cycles behind that aren't part of the scene.
+        after = tracemalloc.take_snapshot()
+        stats = after.compare_to(before, "filename")
+        profile = SceneProfile(filename, sum(stat.size_diff for stat in stats), sum(stat.count_diff for stat in stats))
+        object_sizes(items + colliders, profile.by_type)
+
+        # Each file's own objects, placed on their own, times how often the file is included.
+        files = AssetCache().load_tree(filename)
+        for name, count in include_counts(files, filename).items():
+            own = ObjectFile(name, [record for record in files[name].records if record[0] != "file"])
+            polygons, cols = build_object({name: own}, name)
+            sizes = object_sizes(polygons + cols)
+            profile.by_file[name] = [count, count * sum(entry[0] for entry in sizes.values()),
+                                     count * sum(entry[1] for entry in sizes.values())]
+
+        if frames:
+            t = FrameBuffer(width, height)
+            init(t)
+            cam = Camera(Vector3(0, 2, -3), 0, 1, [0, 0, 0], 0)
+            # The first lap fills one-off caches like the sprite atlas, only the second is measured.
+            for frame in range(frames):
+                cam.y_rotation = frame * 360 / frames
+                render(cam, items, t)
+            for frame in range(frames):
+                cam.y_rotation = frame * 360 / frames
+                gc.collect()
+                gc.disable()  # So garbage made by the frame is still there to be counted.
+                try:
+                    before = tracemalloc.take_snapshot()
+                    tracemalloc.reset_peak()
+                    start_bytes = tracemalloc.get_traced_memory()[0]
+                    start = time.perf_counter()
+                    render(cam, items, t)
+                    elapsed = time.perf_counter() - start
+                    peak = tracemalloc.get_traced_memory()[1] - start_bytes
+                    after = tracemalloc.take_snapshot()
+                finally:
+                    gc.enable()
+                profile.frames.append((peak, frame_allocations(before, after), elapsed * 1000))
+    finally:
+        if not tracing:
+            tracemalloc.stop()
+    return profile
+
+
+def print_profile(profile: SceneProfile):
+    print("%s: %d bytes in %d blocks after loading" % (profile.filename, profile.traced_bytes, profile.traced_blocks))
+    print("  by type:")
+    for name, (count, size) in sorted(profile.by_type.items(), key=lambda x: -x[1][1]):
+        print("    %-16s %8d objects %10d bytes" % (name, count, size))
+    print("  by file:")
+    for name, (included, count, size) in sorted(profile.by_file.items(), key=lambda x: -x[1][2]):
+        print("    %-16s x%-3d %8d objects %10d bytes" % (name, included, count, size))
+    if profile.frames:
+        peaks = [frame[0] for frame in profile.frames]
+        print("  per frame: peak %d bytes (mean %d), %d allocations at most, %.2f ms mean"
+              % (max(peaks), sum(peaks) / len(peaks), profile.frame_allocations(),
+                 sum(frame[2] for frame in profile.frames) / len(profile.frames)))
+
+
+def check_budgets(budgets: dict = None, frames: int = 10, report: Callable = None) -> list:
+    """
+    Profiles each reference scene against its budget.
+    :param report: Called with each SceneProfile, like print_profile.
+    :return: A message for each budget that was exceeded, empty if all passed.
+    """
+    if budgets is None:
+        budgets = REFERENCE_BUDGETS
+    failures = []
+    for filename, budget in budgets.items():
+        profile = profile_scene(filename, frames)
+        if report is not None:
+            report(profile)
+        if profile.traced_bytes > budget.scene_bytes:
+            failures.append("%s holds %d bytes after loading, budget is %d"
+                            % (filename, profile.traced_bytes, budget.scene_bytes))
+        if profile.frame_peak_bytes() > budget.frame_peak_bytes:
+            failures.append("%s peaks at %d bytes in a frame, budget is %d"
+                            % (filename, profile.frame_peak_bytes(), budget.frame_peak_bytes))
+        if profile.frame_allocations() > budget.frame_allocations:
+            failures.append("%s allocates %d blocks in a frame, budget is %d"
+                            % (filename, profile.frame_allocations(), budget.frame_allocations))
+    return failures
+
+
+def main(args: list = None):
+    parser = argparse.ArgumentParser(description="Reports the memory used by a scene and its render loop.")
+    parser.add_argument("scene", nargs="?", help="object file in Objects/ to profile")
+    parser.add_argument("--frames", type=int, default=10, help="frames to render while measuring")
+    parser.add_argument("--check", action="store_true", help="check the reference scenes against their budgets")
+    options = parser.parse_args(args)
+    if options.check:
+        failures = check_budgets(frames=options.frames, report=print_profile)
+        for failure in failures:
+            print("OVER BUDGET: " + failure)
+        sys.exit(1 if failures else 0)
+    if options.scene is None:
+        parser.error("give a scene or --check")
+    print_profile(profile_scene(options.scene, options.frames))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,248 @@
+import math
+import time
+import argparse
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+from renderer import *
+from game_objects import *
+from game import create_file_object
+from framebuffer import FrameBuffer
+
+"""
+A local HTTP service that renders previews of scenes for other tools.
+Scenes stay loaded between requests, and requests for the same scene that arrive together are
+rendered as one batch of views by that scene's render thread.
+
+GET /render?scene=map1&x=0&y=2&z=-3&rot=0&zoom=1&width=320&height=240&format=png
+"""
+
+MAX_SIZE = 2048
+POOLED_BUFFERS = 4  # Frame buffers a scene keeps between batches, one per size.
+
+
+class WorkerClosed(Exception):
+    """
+    Raised by a request to a SceneWorker that was dropped from the cache, get the scene again and retry.
+    """
+
+
+class PendingRender:
+    def __init__(self, key: tuple):
+        self.key = key
+        self.done = threading.Event()
+        self.image = None
+        self.error = None
+
+
+class SceneWorker:
+    """
+    Keeps one scene loaded and renders its requests on a single thread.
+    """
+    def __init__(self, name: str, batch_window: float = 0.005):
+        self.name = name
+        self.items, self.colliders = create_file_object(name)
+        self.geometry = SceneGeometry(self.items)
+        self.batch_window = batch_window
+        self.batches = 0
+        self.renders = 0
+        self._pending = OrderedDict()
+        self._wake = threading.Condition()
+        self._buffers = {}
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, name="render-" + name, daemon=True)
+        self._thread.start()
+
+    def request(self, cam: Camera, width: int, height: int, extension: str) -> bytes:
+        """
+        Queues a render and waits for it, identical requests waiting at the same time share one render.
+        :raises WorkerClosed: If the worker was closed, its thread won't render anything new.
+        """
+        key = (cam.position.x, cam.position.y, cam.position.z, cam.y_rotation, cam.zoom, width, height, extension)
+        with self._wake:
+            if self._closed:
+                raise WorkerClosed(self.name)
+            pending = self._pending.get(key)
+            if pending is None:
+                pending = PendingRender(key)
+                self._pending[key] = pending
+                self._wake.notify()
+        pending.done.wait()
+        if pending.error is not None:
+            raise pending.error
+        return pending.image
+
+    def close(self):
+        """
+        Stops the render thread once it has finished any queued requests.
+        """
+        with self._wake:
+            self._closed = True
+            self._wake.notify()
+
+    def _run(self):
+        while True:
+            with self._wake:
+                while not self._pending and not self._closed:
+                    self._wake.wait()
+                if not self._pending:
+                    return
+            # Give requests arriving at the same time a moment to join the batch.
+            time.sleep(self.batch_window)
+            with self._wake:
+                batch = list(self._pending.values())
+                self._pending = OrderedDict()
+            self.batches += 1
+            try:
+                images = self._render([pending.key for pending in batch])
+                for pending, image in zip(batch, images):
+                    pending.image = image
+                self.renders += len(batch)
+            except Exception:
+                # Render the views one at a time so only the ones that fail get the error.
+                for pending in batch:
+                    try:
+                        pending.image = self._render([pending.key])[0]
+                        self.renders += 1
+                    except Exception as e:
+                        pending.error = e
+            for pending in batch:
+                pending.done.set()
+
+    def _render(self, keys: list) -> list:
+        """
+        Renders a batch of requests as views of one frame, so the scene's geometry is shared between them.
+        """
+        views = []
+        used = {}
+        for x, y, z, rotation, zoom, width, height, extension in keys:
+            # Requests of the same size each need their own buffer.
+            buffers = self._buffers.setdefault((width, height), [])
+            n = used.get((width, height), 0)
+            used[(width, height)] = n + 1
+            if n == len(buffers):
+                t = FrameBuffer(width, height)
+                init(t)
+                buffers.append(t)
+            views.append((Camera(Vector3(x, y, z), rotation, zoom, [0, 0, 0], 0), buffers[n]))
+        render_views(views, self.geometry)
+        images = [t.png() if key[-1] == "png" else t.ppm() for (cam, t), key in zip(views, keys)]
+        # A big batch needs many buffers, only keep one of each of a few sizes the last batch used.
+        self._buffers = {size: self._buffers[size][:1] for size in list(used)[:POOLED_BUFFERS]}
+        return images
+
+
+class SceneCache:
+    """
+    Loaded scenes, the least recently used one is dropped when there are too many.
+    """
+    def __init__(self, max_scenes: int = 8):
+        self.max_scenes = max_scenes
+        self._scenes = OrderedDict()
+        self._lock = threading.Lock()
+        self._loading = {}
+
+    def get(self, name: str) -> SceneWorker:
+        with self._lock:
+            if name in self._scenes:
+                self._scenes.move_to_end(name)
+                return self._scenes[name]
+            # Only one thread loads a scene, the others wait for it.
+            loading = self._loading.get(name)
+            if loading is None:
+                loading = self._loading[name] = threading.Lock()
+        with loading:
+            with self._lock:
+                if name in self._scenes:
+                    return self._scenes[name]
+            try:
+                worker = SceneWorker(name)
+            finally:
+                with self._lock:
+                    self._loading.pop(name, None)
+            with self._lock:
+                self._scenes[name] = worker
+                while len(self._scenes) > self.max_scenes:
+                    self._scenes.popitem(last=False)[1].close()
+            return worker
+
+    def request(self, name: str, cam: Camera, width: int, height: int, extension: str) -> bytes:
+        """
+        Renders a view of a scene, loading the scene again if it's dropped while the request is made.
+        """
+        while True:
+            try:
+                return self.get(name).request(cam, width, height, extension)
+            except WorkerClosed:
+                pass
+
+
+class PreviewHandler(BaseHTTPRequestHandler):
+    cache = None  # Set by serve().
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path != "/render":
+            self.send_error(404, "Unknown path, use /render")
+            return
+        query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        try:
+            scene = query["scene"]
+            if not scene.replace("_", "").replace("-", "").isalnum():
+                raise ValueError("bad scene name")
+            x, y, z, rotation, zoom = (float(query.get(name, default)) for name, default in
+                                       (("x", 0), ("y", 2), ("z", -3), ("rot", 0), ("zoom", 1)))
+            if not all(math.isfinite(n) for n in (x, y, z, rotation, zoom)) or zoom <= 0:
+                raise ValueError("position, rotation and zoom must be finite and zoom above 0")
+            cam = Camera(Vector3(x, y, z), rotation, zoom, [0, 0, 0], 0)
+            width = int(query.get("width", 320))
+            height = int(query.get("height", 240))
+            extension = query.get("format", "png")
+            if not (0 < width <= MAX_SIZE and 0 < height <= MAX_SIZE) or extension not in ("png", "ppm"):
+                raise ValueError("bad size or format")
+        except (KeyError, ValueError) as e:
+            self.send_error(400, "Bad request: %s" % e)
+            return
+        try:
+            image = self.cache.request(scene, cam, width, height, extension)
+        except FileNotFoundError:
+            self.send_error(404, "No scene called " + scene)
+            return
+        except Exception as e:
+            self.send_error(500, "Render failed: %s" % e)
+            return
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png" if extension == "png" else "image/x-portable-pixmap")
+        self.send_header("Content-Length", str(len(image)))
+        self.end_headers()
+        self.wfile.write(image)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(host: str = "127.0.0.1", port: int = 8765, max_scenes: int = 8) -> ThreadingHTTPServer:
+    """
+    Creates the server, call serve_forever() on it to start handling requests.
+    """
+    handler = type("Handler", (PreviewHandler,), {"cache": SceneCache(max_scenes)})
+    return ThreadingHTTPServer((host, port), handler)
+
+
+def main(args: list = None):
+    parser = argparse.ArgumentParser(description="Serves rendered previews of scenes over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--max-scenes", type=int, default=8, help="how many scenes to keep loaded")
+    options = parser.parse_args(args)
+    server = serve(options.host, options.port, options.max_scenes)
+    print("Serving previews on http://%s:%d/render" % server.server_address[:2])
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
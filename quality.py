@@ -0,0 +1,141 @@
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Callable, Union
+
+RENDER_DISTANCE = 40  # How far away things are drawn at full quality.
+
+"""
+Adjusts how much detail the renderer draws so that frames stay close to a target frame time.
+"""
+
+
+@dataclass
+class QualitySettings:
+    render_distance: float = RENDER_DISTANCE  # Polygons further away than this are not drawn.
+    lod_bias: float = 0  # Polygons smaller than this (size / distance) are not drawn.
+    sprite_detail: float = 1  # 1 draws sprite circles smoothly, lower values use fewer segments.
+
+    def other(self):
+        return QualitySettings(self.render_distance, self.lod_bias, self.sprite_detail)
+
+
+@dataclass
+class QualityDecision:
+    frame: int
+    frame_time: float
+    action: str
+    settings: QualitySettings
+
+
+@dataclass
+class QualityController:
+    target_frame_time: float = 1 / 30
+    min_render_distance: float = 10
+    max_render_distance: float = RENDER_DISTANCE
+    max_lod_bias: float = 0.05
+    min_sprite_detail: float = 0.25
+    smoothing: float = 0.1  # How much of each new frame time goes into the running average.
+    tolerance: float = 0.15  # How far off target (as a fraction) the average can be before acting.
+    step: float = 0.1  # How much of the available range each decision moves a setting.
+    cooldown: int = 10  # Frames to wait after a decision before making another one.
+    report: Union[None, Callable] = None
+    settings: QualitySettings = field(default_factory=QualitySettings)
+    average_frame_time: float = 0
+    frame: int = 0
+    decisions: deque = field(default_factory=lambda: deque(maxlen=100))
+    _last_decision: int = 0
+    _frame_start: Union[None, float] = None
+
+    def __post_init__(self):
+        self.settings.render_distance = min(max(self.settings.render_distance, self.min_render_distance),
+                                            self.max_render_distance)
+
+    def begin_frame(self):
+        """
+        Marks the start of a frame, call end_frame() once the frame has been drawn.
+        """
+        self._frame_start = time.perf_counter()
+
+    def end_frame(self) -> QualitySettings:
+        """
+        Measures the time since begin_frame() and updates the settings.
+        :return: The settings to use for the next frame.
+        """
+        if self._frame_start is None:
+            return self.settings
+        frame_time = time.perf_counter() - self._frame_start
+        self._frame_start = None
+        return self.update(frame_time)
+
+    def update(self, frame_time: float) -> QualitySettings:
+        """
+        Adds a measured frame time to the running average and raises or lowers quality if needed.
+        :param frame_time: How long the last frame took in seconds.
+        :return: The settings to use for the next frame.
+        """
+        self.frame += 1
+        if self.average_frame_time == 0:
+            self.average_frame_time = frame_time
+        else:
+            self.average_frame_time += (frame_time - self.average_frame_time) * self.smoothing
+
+        if self.frame - self._last_decision < self.cooldown:
+            return self.settings
+
+        ratio = self.average_frame_time / self.target_frame_time
+        if ratio > 1 + self.tolerance:
+            action = self._lower()
+        elif ratio < 1 - self.tolerance:
+            action = self._raise()
+        else:
+            action = None
+
+        if action is not None:
+            self._last_decision = self.frame
+            decision = QualityDecision(self.frame, self.average_frame_time, action, self.settings.other())
+            self.decisions.append(decision)
+            if self.report is not None:
+                self.report(decision)
+        return self.settings
+
+    def _lower(self) -> Union[None, str]:
+        """
+        Lowers the cheapest-to-lose setting first: distance, then small polygons, then sprite detail.
+        """
+        s = self.settings
+        if s.render_distance > self.min_render_distance:
+            s.render_distance = max(self.min_render_distance,
+                                    s.render_distance - (self.max_render_distance - self.min_render_distance) * self.step)
+            return "render_distance -> %.1f" % s.render_distance
+        if s.lod_bias < self.max_lod_bias:
+            s.lod_bias = round(min(self.max_lod_bias, s.lod_bias + self.max_lod_bias * self.step), 6)
+            return "lod_bias -> %.4f" % s.lod_bias
+        if s.sprite_detail > self.min_sprite_detail:
+            s.sprite_detail = round(max(self.min_sprite_detail, s.sprite_detail - (1 - self.min_sprite_detail) * self.step), 4)
+            return "sprite_detail -> %.2f" % s.sprite_detail
+        return None
+
+    def _raise(self) -> Union[None, str]:
+        """
+        Restores settings in the opposite order they were lowered.
+        """
+        s = self.settings
+        if s.sprite_detail < 1:
+            s.sprite_detail = round(min(1, s.sprite_detail + (1 - self.min_sprite_detail) * self.step), 4)
+            return "sprite_detail -> %.2f" % s.sprite_detail
+        if s.lod_bias > 0:
+            s.lod_bias = round(max(0, s.lod_bias - self.max_lod_bias * self.step), 6)
+            return "lod_bias -> %.4f" % s.lod_bias
+        if s.render_distance < self.max_render_distance:
+            s.render_distance = min(self.max_render_distance,
+                                    s.render_distance + (self.max_render_distance - self.min_render_distance) * self.step)
+            return "render_distance -> %.1f" % s.render_distance
+        return None
+
+
+def print_decision(decision: QualityDecision):
+    """
+    Default reporter which prints each decision the controller makes.
+    """
+    print("[quality] frame %d: %.1f ms average, %s" % (decision.frame, decision.frame_time * 1000, decision.action))
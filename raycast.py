@@ -0,0 +1,362 @@
+import math
+import numpy as np
+from dataclasses import dataclass
+from renderer import *
+from game_objects import *
+
+"""
+Finds what a ray hits in a scene: placing objects where the camera looks, line of sight checks and hitscan.
+Polygons and colliders are split into triangles and kept in a bounding volume hierarchy so a ray only
+tests the few triangles near its path.
+"""
+
+LEAF_SIZE = 8  # Most triangles in a leaf of the hierarchy.
+EPSILON = 1e-9
+
+
+@dataclass
+class RayHit:
+    distance: float
+    point: Vector3
+    normal: Vector3  # Faces back towards the ray's origin.
+    item: object  # The Polygon or collider that was hit.
+    index: int  # Where the item is in items or colliders.
+
+
+class SceneRaycaster:
+    """
+    A bounding volume hierarchy over a scene's polygons and colliders.
+    Items can be added at any time, the hierarchy is rebuilt on the next query.
+    """
+    def __init__(self, items: list = (), colliders: list = ()):
+        self.items = []
+        self.colliders = []
+        self._triangles = []  # (a, b, c) corner tuples.
+        self._owners = []  # (item, index) for each triangle.
+        self._spheres = []
+        self._dirty = True
+        self.add(items, colliders)
+
+    def add(self, items: list = (), colliders: list = ()):
+        """
+        Adds polygons (other items like Sprites are skipped) and colliders to the scene.
+        """
+        for item in items:
+            index = len(self.items)
+            self.items.append(item)
+            if type(item) == Polygon and len(item.points) > 2:
+                a = item.points[0]
+                for b, c in zip(item.points[1:], item.points[2:]):
+                    self._triangles.append(((a.x, a.y, a.z), (b.x, b.y, b.z), (c.x, c.y, c.z)))
+                    self._owners.append((item, index))
+        for col in colliders:
+            index = len(self.colliders)
+            self.colliders.append(col)
+            if type(col) == SphereCollider:
+                self._spheres.append((col, index))
+                continue
+            corners = collider_corners(col)
+            for a, b, c in ((corners[0], corners[1], corners[2]), (corners[0], corners[2], corners[3])):
+                self._triangles.append(((a.x, a.y, a.z), (b.x, b.y, b.z), (c.x, c.y, c.z)))
+                self._owners.append((col, index))
+        self._dirty = True
+
+    def remove(self, items: list):
+        """
+        Removes polygons or colliders, matched by identity.
+        """
+        gone = set(id(item) for item in items)
+        self.items = [item for item in self.items if id(item) not in gone]
+        self.colliders = [col for col in self.colliders if id(col) not in gone]
+        # What's left moves up in the lists, so hits need their new indices.
+        indices = {id(item): i for i, item in enumerate(self.items)}
+        indices.update((id(col), i) for i, col in enumerate(self.colliders))
+        keep = [i for i, (owner, index) in enumerate(self._owners) if id(owner) not in gone]
+        self._triangles = [self._triangles[i] for i in keep]
+        self._owners = [(self._owners[i][0], indices[id(self._owners[i][0])]) for i in keep]
+        self._spheres = [(col, indices[id(col)]) for col, index in self._spheres if id(col) not in gone]
+        self._dirty = True
+
+    def _build(self):
+        count = len(self._triangles)
+        tris = np.array(self._triangles, dtype=float).reshape(count, 3, 3)
+        self._lo = tris.min(axis=1)
+        self._hi = tris.max(axis=1)
+        centers = (self._lo + self._hi) / 2
+        # Nodes are (lo, hi, left, right, start, end), leaves have left == -1.
+        self._nodes = []
+        order = np.arange(count)
+        self._order = order
+        if count:
+            self._split(order, centers, 0, count)
+        self._tri_a = tris[:, 0][order]
+        self._tri_e1 = (tris[:, 1] - tris[:, 0])[order]
+        self._tri_e2 = (tris[:, 2] - tris[:, 0])[order]
+        self._tri_owner = [self._owners[i] for i in order]
+        self._dirty = False
+
+    def _split(self, order: np.ndarray, centers: np.ndarray, start: int, end: int) -> int:
+        rows = order[start:end]
+        lo = self._lo[rows].min(axis=0)
+        hi = self._hi[rows].max(axis=0)
+        node = len(self._nodes)
+        self._nodes.append(None)
+        if end - start <= LEAF_SIZE:
+            self._nodes[node] = (tuple(lo.tolist()), tuple(hi.tolist()), -1, -1, start, end)
+            return node
+        # Split at the median along the axis the triangle centers spread furthest on.
+        axis = int((centers[rows].max(axis=0) - centers[rows].min(axis=0)).argmax())
+        order[start:end] = rows[np.argsort(centers[rows, axis], kind="stable")]
+        middle = (start + end) // 2
+        left = self._split(order, centers, start, middle)
+        right = self._split(order, centers, middle, end)
+        self._nodes[node] = (tuple(lo.tolist()), tuple(hi.tolist()), left, right, start, end)
+        return node
+
+    def raycast(self, origin: Vector3, direction: Vector3, max_distance: float = math.inf) -> Union[None, RayHit]:
+        """
+        Finds the nearest thing a ray hits.
+        :param origin: Where the ray starts.
+        :param direction: Which way the ray goes, doesn't need to be normalized.
+        :param max_distance: Hits further than this are ignored.
+        :return: The nearest hit, or None.
+        """
+        if self._dirty:
+            self._build()
+        length = direction.magnitude()
+        if length == 0:
+            return None
+        o = (origin.x, origin.y, origin.z)
+        d = (direction.x / length, direction.y / length, direction.z / length)
+        inv = tuple(1 / c if c != 0 else math.inf for c in d)
+        best = max_distance
+        best_tri = -1
+        best_sphere = None
+
+        stack = [0] if self._nodes else []
+        while stack:
+            lo, hi, left, right, start, end = self._nodes[stack.pop()]
+            near = box_entry(o, inv, lo, hi)
+            if near is None or near > best:
+                continue
+            if left == -1:
+                t, tri = self._leaf(o, d, start, end)
+                if t < best:
+                    best = t
+                    best_tri = tri
+            else:
+                stack.append(right)
+                stack.append(left)
+
+        for col, index in self._spheres:
+            t = sphere_entry(o, d, col)
+            if t is not None and t < best:
+                best = t
+                best_sphere = (col, index)
+                best_tri = -1
+
+        return self._hit(o, d, best, best_tri, best_sphere)
+
+    def _hit(self, o: tuple, d: tuple, distance: float, tri: int, sphere: Union[None, tuple]) -> Union[None, RayHit]:
+        """
+        Makes the RayHit for the nearest triangle or (collider, index) sphere a ray hit.
+        """
+        if sphere is None and tri == -1:
+            return None
+        point = Vector3(o[0] + d[0] * distance, o[1] + d[1] * distance, o[2] + d[2] * distance)
+        if sphere is not None:
+            col, index = sphere
+            return RayHit(distance, point, (point - col.position).normalize(), col, index)
+        normal = Vector3(*np.cross(self._tri_e1[tri], self._tri_e2[tri]).tolist()).normalize()
+        if (normal ^ Vector3(*d)) > 0:
+            normal = -normal
+        item, index = self._tri_owner[tri]
+        return RayHit(distance, point, normal, item, index)
+
+    def _leaf(self, o: tuple, d: tuple, start: int, end: int) -> tuple:
+        """
+        Moller-Trumbore test of one ray against every triangle in a leaf at once.
+        :return: (distance, triangle) of the nearest hit, distance is inf if nothing was hit.
+        """
+        e1 = self._tri_e1[start:end]
+        e2 = self._tri_e2[start:end]
+        d = np.array(d)
+        p = np.cross(d, e2)
+        det = (e1 * p).sum(axis=1)
+        valid = np.abs(det) > EPSILON
+        inv_det = np.divide(1, det, out=np.zeros_like(det), where=valid)
+        s = np.array(o) - self._tri_a[start:end]
+        u = (s * p).sum(axis=1) * inv_det
+        q = np.cross(s, e1)
+        v = (q * d).sum(axis=1) * inv_det
+        t = (e2 * q).sum(axis=1) * inv_det
+        hit = valid & (u >= 0) & (v >= 0) & (u + v <= 1) & (t > EPSILON)
+        if not hit.any():
+            return math.inf, -1
+        t = np.where(hit, t, np.inf)
+        best = int(t.argmin())
+        return float(t[best]), start + best
+
+    def raycast_many(self, origins: list, directions: list, max_distance: float = math.inf) -> list:
+        """
+        Casts many rays as one packet. Each node of the hierarchy is tested against every ray still in it at
+        once, and a leaf's triangles against all of those rays at once, so the hierarchy is walked once
+        instead of once per ray. Gives the same hits as calling raycast for each ray.
+        :return: A RayHit or None for each ray.
+        """
+        if self._dirty:
+            self._build()
+        o = np.array([(p.x, p.y, p.z) for p in origins], dtype=float).reshape(-1, 3)
+        d = np.array([(v.x, v.y, v.z) for v in directions], dtype=float).reshape(-1, 3)
+        length = np.sqrt((d ** 2).sum(axis=1))
+        live = np.flatnonzero(length > 0)
+        d[live] /= length[live, None]
+        with np.errstate(divide="ignore"):
+            inv = 1 / d
+        best = np.full(len(o), max_distance, dtype=float)
+        best_tri = np.full(len(o), -1)
+        best_sphere = np.full(len(o), -1)
+
+        stack = [(0, live)] if self._nodes and len(live) else []
+        while stack:
+            node, rays = stack.pop()
+            lo, hi, left, right, start, end = self._nodes[node]
+            rays = rays[box_entries(o[rays], inv[rays], lo, hi) <= best[rays]]
+            if len(rays) == 0:
+                continue
+            if left == -1:
+                t, tri = self._leaf_many(o[rays], d[rays], start, end)
+                closer = t < best[rays]
+                best[rays[closer]] = t[closer]
+                best_tri[rays[closer]] = tri[closer]
+            else:
+                stack.append((right, rays))
+                stack.append((left, rays))
+
+        for k, (col, index) in enumerate(self._spheres):
+            t = sphere_entries(o[live], d[live], col)
+            closer = t < best[live]
+            best[live[closer]] = t[closer]
+            best_sphere[live[closer]] = k
+            best_tri[live[closer]] = -1
+
+        hits = [None] * len(o)
+        for i in np.flatnonzero((best_tri >= 0) | (best_sphere >= 0)).tolist():
+            sphere = self._spheres[best_sphere[i]] if best_sphere[i] >= 0 else None
+            hits[i] = self._hit(tuple(o[i].tolist()), tuple(d[i].tolist()), float(best[i]), int(best_tri[i]), sphere)
+        return hits
+
+    def _leaf_many(self, o: np.ndarray, d: np.ndarray, start: int, end: int) -> tuple:
+        """
+        Moller-Trumbore test of (n, 3) rays against every triangle in a leaf at once.
+        :return: (distances, triangles) of each ray's nearest hit, distance is inf where a ray hit nothing.
+        """
+        e1 = self._tri_e1[start:end]
+        e2 = self._tri_e2[start:end]
+        d = d[:, None]
+        p = np.cross(d, e2)
+        det = (e1 * p).sum(axis=2)
+        valid = np.abs(det) > EPSILON
+        inv_det = np.divide(1, det, out=np.zeros_like(det), where=valid)
+        s = o[:, None] - self._tri_a[start:end]
+        u = (s * p).sum(axis=2) * inv_det
+        q = np.cross(s, e1)
+        v = (q * d).sum(axis=2) * inv_det
+        t = (e2 * q).sum(axis=2) * inv_det
+        hit = valid & (u >= 0) & (v >= 0) & (u + v <= 1) & (t > EPSILON)
+        t = np.where(hit, t, np.inf)
+        best = t.argmin(axis=1)
+        return t[np.arange(len(t)), best], start + best
+
+    def line_of_sight(self, start: Vector3, end: Vector3) -> bool:
+        """
+        Checks if nothing blocks the straight line between two points.
+        """
+        return self.raycast(start, end - start, start.distance(end)) is None
+
+
+def collider_corners(col) -> list:
+    """
+    Finds the four world space corners of a plane, slope or wall collider.
+    """
+    p = col.position
+    if type(col) == WallCollider:
+        local = [Vector3(p.x, p.y, p.z), Vector3(p.x + col.x, p.y, p.z),
+                 Vector3(p.x + col.x, p.y + col.y, p.z), Vector3(p.x, p.y + col.y, p.z)]
+    else:
+        slope = col.slope if type(col) == SlopeCollider else 0
+        local = [Vector3(p.x, p.y, p.z), Vector3(p.x + col.x, p.y, p.z),
+                 Vector3(p.x + col.x, p.y + slope * col.z, p.z + col.z), Vector3(p.x, p.y + slope * col.z, p.z + col.z)]
+    # Colliders are tested by rotating points into their space, so rotate the other way to get back out.
+    return [corner.rotate_around(p, Vector3(0, -col.y_rotation, 0)) for corner in local]
+
+
+def box_entry(o: tuple, inv: tuple, lo: tuple, hi: tuple) -> Union[None, float]:
+    """
+    Slab test of a ray against a box.
+    :return: How far along the ray it enters the box, or None if it misses.
+    """
+    near = 0.0
+    far = math.inf
+    for axis in range(3):
+        if inv[axis] == math.inf:
+            if o[axis] < lo[axis] or o[axis] > hi[axis]:
+                return None
+            continue
+        t1 = (lo[axis] - o[axis]) * inv[axis]
+        t2 = (hi[axis] - o[axis]) * inv[axis]
+        if t1 > t2:
+            t1, t2 = t2, t1
+        if t1 > near:
+            near = t1
+        if t2 < far:
+            far = t2
+        if near > far:
+            return None
+    return near
+
+
+def box_entries(o: np.ndarray, inv: np.ndarray, lo: tuple, hi: tuple) -> np.ndarray:
+    """
+    box_entry for (n, 3) rays at once.
+    :return: How far along each ray it enters the box, inf where it misses.
+    """
+    lo = np.array(lo)
+    hi = np.array(hi)
+    with np.errstate(invalid="ignore"):
+        t1 = (lo - o) * inv
+        t2 = (hi - o) * inv
+    # A ray parallel to a slab is inside it everywhere or nowhere.
+    flat = np.isinf(inv)
+    inside = (o >= lo) & (o <= hi)
+    near = np.where(flat, np.where(inside, -np.inf, np.inf), np.minimum(t1, t2))
+    far = np.where(flat, np.where(inside, np.inf, -np.inf), np.maximum(t1, t2))
+    near = np.maximum(near.max(axis=1), 0)
+    return np.where(near <= far.min(axis=1), near, np.inf)
+
+
+def sphere_entries(o: np.ndarray, d: np.ndarray, col: SphereCollider) -> np.ndarray:
+    """
+    sphere_entry for (n, 3) rays at once, inf where a ray misses.
+    """
+    oc = o - (col.position.x, col.position.y, col.position.z)
+    b = (oc * d).sum(axis=1)
+    c = (oc ** 2).sum(axis=1) - col.r ** 2
+    disc = b * b - c
+    root = np.sqrt(np.maximum(disc, 0))
+    t = -b - root
+    t = np.where(t <= EPSILON, -b + root, t)
+    return np.where((disc >= 0) & (t > EPSILON), t, np.inf)
+
+
+def sphere_entry(o: tuple, d: tuple, col: SphereCollider) -> Union[None, float]:
+    oc = (o[0] - col.position.x, o[1] - col.position.y, o[2] - col.position.z)
+    b = oc[0] * d[0] + oc[1] * d[1] + oc[2] * d[2]
+    c = oc[0] ** 2 + oc[1] ** 2 + oc[2] ** 2 - col.r ** 2
+    disc = b * b - c
+    if disc < 0:
+        return None
+    t = -b - math.sqrt(disc)
+    if t <= EPSILON:
+        t = -b + math.sqrt(disc)
+    return t if t > EPSILON else None
@@ -2,15 +2,20 @@ from vectors import *
 from game_objects import Camera
 from dataclasses import dataclass
 from turtle import Turtle
-import turtle
+import functools
+import heapq
+import math
+import numpy as np
+from quality import QualitySettings, RENDER_DISTANCE
 
-RENDER_DISTANCE = 40
+CAM_CLOSE = 0.25  # How close you want to render items: Do not put at 0 or below.
 
 @dataclass
 class Polygon:
     points: list
     middle: Vector3
     color: tuple
+    radius: float = 0
 
     def instantiate(self):
         mid_x = 0
@@ -21,6 +26,7 @@ class Polygon:
             mid_y += vector.y / len(self.points)
             mid_z += vector.z / len(self.points)
         self.middle = Vector3(mid_x, mid_y, mid_z)
+        self.radius = max(self.middle.distance(vector) for vector in self.points)
 
         c = 0.25 -((self.facing().y + 1) / 8) + ((self.facing().x + 1) / 10) + ((self.facing().z + 1) / 20) + 0.5
         self.color = (self.color[0]*c, self.color[1]*c, self.color[2]*c)
@@ -36,6 +42,48 @@ class Sprite:
     scale: float
 
 
+@dataclass
+class SpriteDraw:
+    """
+    A sprite that has already been projected onto the screen.
+    """
+    file: str
+    x: float
+    y: float
+    size: float
+
+
+@dataclass
+class FrameState:
+    """
+    Remembers what the last drawn frame showed so unchanged frames can be skipped.
+    Call scene_changed() whenever items are added, removed or moved.
+    """
+    scene_revision: int = 0
+    position_tolerance: float = 0.0005  # Camera movement smaller than this doesn't redraw.
+    rotation_tolerance: float = 0.01
+    _drawn: tuple = None
+
+    def scene_changed(self):
+        self.scene_revision += 1
+
+    def needs_render(self, cam: Camera, quality: QualitySettings = None, entities=None) -> bool:
+        """
+        Checks if the camera, scene, quality or entities changed since the last drawn frame.
+        If they did, the new state is remembered as drawn.
+        """
+        extra = (self.scene_revision, cam.zoom,
+                 None if quality is None else (quality.render_distance, quality.lod_bias, quality.sprite_detail),
+                 None if entities is None else entities.revision)
+        if self._drawn is not None:
+            position, rotation, drawn_extra = self._drawn
+            if (extra == drawn_extra and position.distance(cam.position) < self.position_tolerance
+                    and abs(rotation - cam.y_rotation) < self.rotation_tolerance):
+                return False
+        self._drawn = (cam.position.other(), cam.y_rotation, extra)
+        return True
+
+
 def create_poly(color: tuple, *args: Vector3):
     """
     Creates a polygon object out of a series of points and a color.
@@ -47,34 +95,180 @@ def create_poly(color: tuple, *args: Vector3):
     poly.instantiate()
     return poly
 
-def init(t: Turtle()):
+@functools.lru_cache(maxsize=None)
+def load_sprite(file: str) -> tuple:
+    """
+    Reads a .tur file once and keeps its commands so sprites aren't re-read every frame.
+    :param file: The name of the sprite file.
+    :return: A tuple of commands, each a tuple of the command name followed by its arguments.
+    """
+    commands = []
+    with open("Sprites/" + file + ".tur") as f:
+        for line in f:
+            command = line.strip().split()
+            if command:
+                commands.append((command[0], *(float(arg) for arg in command[1:])))
+    return tuple(commands)
+
+
+def draw_sprite(t: Turtle, file: str, x: float, y: float, size: float, circle_steps: int = None):
+    """
+    Draws a sprite using the commands in its .tur file.
+    :param t: turtle drawing the sprite.
+    :param file: The name of the sprite file.
+    :param x: Screen position of the sprite.
+    :param y: Screen position of the sprite.
+    :param size: How much to scale the sprite's lengths by.
+    :param circle_steps: How many segments to draw circles with, None lets turtle decide.
+    """
+    # FrameBuffers copy a pre-rasterized bitmap instead.
+    atlas = getattr(t, "atlas", None)
+    if atlas is not None and atlas.draw(t, file, x, y, size):
+        return
+    t.up()
+    t.goto(x, y)
+    t.setheading(0)
+    for command in load_sprite(file):
+        if command[0] == "f":
+            t.forward(size * command[1])
+        elif command[0] == "c":
+            if len(command) == 3:
+                t.circle(size * command[1], command[2], circle_steps)
+            elif len(command) == 4:
+                t.circle(size * command[1], command[2], int(command[3]))
+            else:
+                t.circle(size * command[1], None, circle_steps)
+        elif command[0] == "u":
+            t.up()
+        elif command[0] == "d":
+            t.down()
+        elif command[0] == "r":
+            t.right(command[1])
+        elif command[0] == "f_b":
+            t.begin_fill()
+        elif command[0] == "f_e":
+            t.end_fill()
+        elif command[0] == "f_c":
+            t.fillcolor((command[1], command[2], command[3]))
+
+
+def init(t: Turtle):
     """
     Sets up the initial conditions for turtle.
     """
     t.up()
     t.speed(0)
     t.hideturtle()
-    turtle.tracer(False)
+    t.screen.tracer(False)
     t.goto(0, 0)
 
 
-def render(cam: Camera, items: list, t: Turtle()):
+def draw_polygon(t: Turtle, relative_points: list, color: tuple, cam_close: float = CAM_CLOSE):
+    """
+    Clips a polygon against the camera's near plane and draws it.
+    :param relative_points: The polygon's points relative to the camera, changed while clipping.
+    :param color: The fill and outline color.
+    """
+    t.fillcolor(color)
+    t.pencolor(color)
+    # Check if Polygon is in view.
+    in_range = False
+    popped = 0
+    for i in range(len(relative_points)):
+        i -= popped
+        point = relative_points[i]
+        if (i + 1) > len(relative_points) - 1:
+            next_point = relative_points[0]
+        else:
+            next_point = relative_points[i + 1]
+
+        def find_y(point1, point2, new_x) -> float:
+            if point2.x - point1.x != 0:
+                return (point2.y - point1.y) * ((new_x - point1.x) / (point2.x - point1.x))
+            else:
+                return 0
+
+        if point.z > cam_close:
+            in_range = True
+            # If it's not in view, then move the point to appear like it's being cut off by the camera.
+        elif next_point.z > cam_close and relative_points[i - 1].z > cam_close:
+            # If only one point is cut off, then split it in two
+            line1 = Line(point.other(), next_point.other())
+            line2 = Line(point.other(), relative_points[i - 1].other())
+            point.z = cam_close
+            line = Line(point.other() + Vector3(20, 0, 0), point.other() + Vector3(-20, 0, 0))
+            x, z = line.line_intersection(line1)
+            x_, z_ = line.line_intersection(line2)
+            other_point = point.other()
+
+            other_point.x = x_
+            other_point.y += find_y(point, relative_points[i - 1], x_)
+            point.y += find_y(point, next_point, x)
+            point.x = x
+            relative_points.insert(i, other_point)
+        elif next_point.z > cam_close:
+            # If two points are cut off, then move them to the camera cut-off.
+            line1 = Line(point.other(), next_point.other())
+            point.z = cam_close
+            line = Line(point.other() + Vector3(20, 0, 0), point.other() + Vector3(-20, 0, 0))
+            x, z = line.line_intersection(line1)
+            point.y += find_y(point, next_point, x)
+            point.x = x
+        elif relative_points[i - 1].z > cam_close:
+            # If two points are cut off, then move them to the camera cut-off.
+            line1 = Line(point.other(), relative_points[i - 1].other())
+            point.z = cam_close
+            line = Line(point.other() + Vector3(20, 0, 0), point.other() + Vector3(-20, 0, 0))
+            x, z = line.line_intersection(line1)
+            point.y += find_y(point, relative_points[i - 1], x)
+            point.x = x
+        else:
+            # If the points around this point are cut off, then remove this point.
+            relative_points.pop(i)
+            popped += 1
+
+    # Draw
+    if in_range:
+        t.up()
+        first = relative_points.pop(0)
+        relative_points.append(first)
+        t.goto(first.x / first.z, first.y / first.z)
+        t.down()
+        t.begin_fill()
+        for point in relative_points:
+            t.goto(point.x / point.z, point.y / point.z)
+        t.end_fill()
+        t.up()
+
+
+def render(cam: Camera, items: list, t: Turtle, quality: QualitySettings = None, entities=None):
     """
     Moves the turtle so that it draws a three-dimensional image on a 2D screen.
     :param cam: The location, rotation, and all other information of the camera.
     :param items: A List of Polygons and other 3D objects to be rendered.
     :param t: turtle rendering this frame.
+    :param quality: How much detail to draw, defaults to full detail up to RENDER_DISTANCE.
+    :param entities: An EntityStore whose sprites are drawn along with the items.
     """
-    items = sorted(items, key=lambda x: x.middle.distance(cam.position), reverse=True)
+    if quality is None:
+        quality = QualitySettings(RENDER_DISTANCE)
+    items = [(item.middle.distance(cam.position), item) for item in items]
+    items.sort(key=lambda x: x[0], reverse=True)
+    if entities is not None:
+        # Both lists are sorted far to near, so merging keeps the painter's order.
+        items = heapq.merge(items, entities.project(cam, CAM_CLOSE, quality.render_distance),
+                            key=lambda x: x[0], reverse=True)
     t.clear()
     init(t)
-    turtle.setworldcoordinates(-cam.zoom, -cam.zoom, cam.zoom, cam.zoom)
-    cam_close = 0.25  # How close you want to render items: Do not put at 0 or below.
-    for item in items:
-        if (type(item) == Polygon and item.middle.distance(cam.position) < RENDER_DISTANCE
+    t.screen.setworldcoordinates(-cam.zoom, -cam.zoom, cam.zoom, cam.zoom)
+    cam_close = CAM_CLOSE
+    circle_steps = None
+    if quality.sprite_detail < 1:
+        circle_steps = max(4, int(24 * quality.sprite_detail))
+    for distance, item in items:
+        if (type(item) == Polygon and distance < quality.render_distance
+                and item.radius >= quality.lod_bias * distance
                 and (item.facing() ^ (cam.position - item.middle).normalize()) <= 0):
-            t.fillcolor(item.color)
-            t.pencolor(item.color)
             # Setup points
             relative_points = []
             for point in item.points:
@@ -82,116 +276,117 @@ def render(cam: Camera, items: list, t: Turtle()):
                 relative_points.append(Vector3(pos.x - cam.position.x,
                                                pos.y - cam.position.y,
                                                pos.z - cam.position.z))
-            # Check if Polygon is in view.
-            in_range = False
-            popped = 0
-            for i in range(len(relative_points)):
-                i -= popped
-                point = relative_points[i]
-                if (i + 1) > len(relative_points) - 1:
-                    next_point = relative_points[0]
-                else:
-                    next_point = relative_points[i + 1]
-
-                def find_y(point1, point2, new_x) -> float:
-                    if point2.x - point1.x != 0:
-                        return (point2.y - point1.y) * ((new_x - point1.x) / (point2.x - point1.x))
-                    else:
-                        return 0
-
-                if point.z > cam_close:
-                    in_range = True
-                    # If it's not in view, then move the point to appear like it's being cut off by the camera.
-                elif next_point.z > cam_close and relative_points[i - 1].z > cam_close:
-                    # If only one point is cut off, then split it in two
-                    line1 = Line(point.other(), next_point.other())
-                    line2 = Line(point.other(), relative_points[i - 1].other())
-                    point.z = cam_close
-                    line = Line(point.other() + Vector3(20, 0, 0), point.other() + Vector3(-20, 0, 0))
-                    x, z = line.line_intersection(line1)
-                    x_, z_ = line.line_intersection(line2)
-                    other_point = point.other()
-
-                    other_point.x = x_
-                    other_point.y += find_y(point, relative_points[i - 1], x_)
-                    point.y += find_y(point, next_point, x)
-                    point.x = x
-                    relative_points.insert(i, other_point)
-                elif next_point.z > cam_close:
-                    # If two points are cut off, then move them to the camera cut-off.
-                    line1 = Line(point.other(), next_point.other())
-                    point.z = cam_close
-                    line = Line(point.other() + Vector3(20, 0, 0), point.other() + Vector3(-20, 0, 0))
-                    x, z = line.line_intersection(line1)
-                    point.y += find_y(point, next_point, x)
-                    point.x = x
-                elif relative_points[i - 1].z > cam_close:
-                    # If two points are cut off, then move them to the camera cut-off.
-                    line1 = Line(point.other(), relative_points[i - 1].other())
-                    point.z = cam_close
-                    line = Line(point.other() + Vector3(20, 0, 0), point.other() + Vector3(-20, 0, 0))
-                    x, z = line.line_intersection(line1)
-                    point.y += find_y(point, relative_points[i - 1], x)
-                    point.x = x
-                else:
-                    # If the points around this point are cut off, then remove this point.
-                    relative_points.pop(i)
-                    popped += 1
-
-            # Draw
-            if in_range:
-                t.up()
-                first = relative_points.pop(0)
-                relative_points.append(first)
-                t.goto(first.x / first.z, first.y / first.z)
-                t.down()
-                t.begin_fill()
-                for point in relative_points:
-                    t.goto(point.x / point.z, point.y / point.z)
-                t.end_fill()
-                t.up()
-
-        elif type(item) == Sprite:
+            draw_polygon(t, relative_points, item.color, cam_close)
+
+        elif type(item) == Sprite and distance < quality.render_distance:
             # Calculate sprite center
             pos = item.middle.rotate_around(cam.position, Vector3(0, -cam.y_rotation, 0))
             point = Vector3(pos.x - cam.position.x,
                             pos.y - cam.position.y,
                             pos.z - cam.position.z)
             # Find if sprite is visible
-            in_range = True
-            if point.z <= cam_close:
-                in_range = False
-
-            if in_range:  # Draw using .tur file.
-                t.up()
-                t.goto(point.x / point.z, point.y / point.z)
-                with open("Sprites/" + item.file + ".tur") as file:
-                    t.setheading(0)
-                    for line in file:
-                        strip = line.strip()
-                        command = strip.split()
-                        if command:
-                            if command[0] == "f":
-                                t.forward((item.scale * float(command[1])) / point.z)
-                            elif command[0] == "c":
-                                if len(command) == 3:
-                                    t.circle((item.scale * float(command[1])) / point.z, command[2])
-                                elif len(command) == 4:
-                                    t.circle((item.scale * float(command[1])) / point.z, command[2], command[3])
-                                else:
-                                    t.circle((item.scale * float(command[1])) / point.z)
-                            elif command[0] == "u":
-                                t.up()
-                            elif command[0] == "d":
-                                t.down()
-                            elif command[0] == "r":
-                                t.right(float(command[1]))
-                            elif command[0] == "f_b":
-                                t.begin_fill()
-                            elif command[0] == "f_e":
-                                t.end_fill()
-                            elif command[0] == "f_c":
-                                t.fillcolor((float(command[1]), float(command[2]), float(command[3])))
-                            else:
-                                pass
-    turtle.update()
+            if point.z > cam_close:
+                draw_sprite(t, item.file, point.x / point.z, point.y / point.z, item.scale / point.z, circle_steps)
+
+        elif type(item) == SpriteDraw:
+            draw_sprite(t, item.file, item.x, item.y, item.size, circle_steps)
+    t.screen.update()
+
+
+class SceneGeometry:
+    """
+    The parts of a scene that are the same from every camera: where each item is, which way each polygon
+    faces and its points, kept in arrays so several views can be worked out at once.
+    Make a new one when items are added, removed or moved.
+    """
+    def __init__(self, items: list):
+        """
+        :param items: Polygons and Sprites.
+        """
+        self.items = list(items)
+        count = len(self.items)
+        self.polygon = np.array([type(item) == Polygon for item in self.items], dtype=bool)
+        self.middles = np.array([(item.middle.x, item.middle.y, item.middle.z) for item in self.items],
+                                dtype=float).reshape(count, 3)
+        self.radius = np.array([item.radius if type(item) == Polygon else 0 for item in self.items], dtype=float)
+        self.normals = np.zeros((count, 3))
+        points = []
+        self.counts = np.zeros(count, dtype=int)
+        owners = []
+        for i, item in enumerate(self.items):
+            if type(item) == Polygon:
+                facing = item.facing()
+                self.normals[i] = (facing.x, facing.y, facing.z)
+                points.extend((point.x, point.y, point.z) for point in item.points)
+                owners.extend([i] * len(item.points))
+                self.counts[i] = len(item.points)
+        self.points = np.array(points, dtype=float).reshape(len(points), 3)
+        self.owners = np.array(owners, dtype=int)
+
+
+def render_views(views: list, geometry: SceneGeometry, quality: QualitySettings = None, entities=None):
+    """
+    Renders one scene from several cameras. Distances, culling and camera space points are worked out
+    for every view in the same array operations, only the clipping and drawing is done per view.
+    Draws the same image as calling render() for each view.
+    :param views: (Camera, Turtle) pairs, each turtle draws its camera's view.
+    :param geometry: The scene to draw.
+    :param quality: How much detail to draw, defaults to full detail up to RENDER_DISTANCE.
+    :param entities: An EntityStore whose sprites are drawn along with the items.
+    """
+    if quality is None:
+        quality = QualitySettings(RENDER_DISTANCE)
+    cams = [cam for cam, t in views]
+    eyes = np.array([(cam.position.x, cam.position.y, cam.position.z) for cam in cams], dtype=float).reshape(len(cams), 3)
+    offset = geometry.middles[None, :, :] - eyes[:, None, :]
+    distance = np.sqrt(offset[:, :, 0] ** 2 + offset[:, :, 1] ** 2 + offset[:, :, 2] ** 2)
+    in_range = distance < quality.render_distance
+    facing_away = (geometry.normals[None, :, :] * offset).sum(axis=2) >= 0
+    polygons = (geometry.polygon & in_range & (geometry.radius >= quality.lod_bias * distance)
+                & facing_away)
+    drawn = polygons | (~geometry.polygon & in_range)
+
+    # Move the points of every polygon any view can see into each camera's space at once.
+    needed = polygons.any(axis=0)
+    points = geometry.points[needed[geometry.owners]]
+    starts = np.zeros(len(geometry.items), dtype=int)
+    starts[needed] = np.cumsum(geometry.counts[needed]) - geometry.counts[needed]
+    s_y = np.array([math.sin(-cam.y_rotation * (math.pi/180)) for cam in cams])[:, None]
+    c_y = np.array([math.cos(-cam.y_rotation * (math.pi/180)) for cam in cams])[:, None]
+    x = points[None, :, 0] - eyes[:, 0:1]
+    z = points[None, :, 2] - eyes[:, 2:3]
+    relative = np.empty((len(cams), len(points), 3))
+    relative[:, :, 0] = (x * c_y - z * s_y + eyes[:, 0:1]) - eyes[:, 0:1]
+    relative[:, :, 1] = points[None, :, 1] - eyes[:, 1:2]
+    relative[:, :, 2] = (x * s_y + z * c_y + eyes[:, 2:3]) - eyes[:, 2:3]
+
+    circle_steps = None
+    if quality.sprite_detail < 1:
+        circle_steps = max(4, int(24 * quality.sprite_detail))
+    for view, (cam, t) in enumerate(views):
+        indices = np.nonzero(drawn[view])[0]
+        indices = indices[np.argsort(-distance[view, indices], kind="stable")]
+        order = list(zip(distance[view, indices].tolist(), indices.tolist()))
+        if entities is not None:
+            order = heapq.merge(order, entities.project(cam, CAM_CLOSE, quality.render_distance),
+                                key=lambda x: x[0], reverse=True)
+        t.clear()
+        init(t)
+        t.screen.setworldcoordinates(-cam.zoom, -cam.zoom, cam.zoom, cam.zoom)
+        rows = relative[view].tolist()
+        for d, entry in order:
+            if type(entry) == SpriteDraw:
+                draw_sprite(t, entry.file, entry.x, entry.y, entry.size, circle_steps)
+                continue
+            item = geometry.items[entry]
+            if type(item) == Polygon:
+                start = starts[entry]
+                draw_polygon(t, [Vector3(*row) for row in rows[start:start + geometry.counts[entry]]], item.color)
+            else:
+                pos = item.middle.rotate_around(cam.position, Vector3(0, -cam.y_rotation, 0))
+                point = Vector3(pos.x - cam.position.x,
+                                pos.y - cam.position.y,
+                                pos.z - cam.position.z)
+                if point.z > CAM_CLOSE:
+                    draw_sprite(t, item.file, point.x / point.z, point.y / point.z, item.scale / point.z, circle_steps)
+        t.screen.update()
@@ -0,0 +1,288 @@
+import math
+import numpy as np
+from renderer import *
+from game_objects import *
+from loader import AssetCache, build_collider, shared_executor
+from raycast import collider_corners
+
+"""
+A scene kept as a tree of nodes that matches the .obj include hierarchy, so parts of a loaded map can
+move after loading. Each node has a transform relative to its parent and caches its world transform,
+its placed polygons, colliders and sprites, and the bounding box of its whole subtree.
+Moving a node only marks it dirty; update() then redoes the moved subtree and the bounds of its ancestors
+and leaves the rest of the scene alone.
+
+The placed objects are updated in place, so lists holding them (render lists, raycasters) stay valid,
+but anything that copies their values, like a ColliderBatch, has to be rebuilt after an update.
+"""
+
+
+class SceneNode:
+    """
+    One object in the scene, placed relative to its parent the same way a file line places an include:
+    scaled by the parent's scale, offset by its position, then rotated around it.
+    """
+    def __init__(self, name: str, records: list = (), position: Vector3 = Vector3(0, 0, 0), y_rotation: float = 0,
+                 scale: Vector3 = Vector3(1, 1, 1)):
+        """
+        :param name: The file the node was loaded from.
+        :param records: The file's parsed records, includes are added as children separately.
+        """
+        self.name = name
+        self.position = position
+        self.y_rotation = y_rotation
+        self.scale = scale
+        self.parent = None
+        self.children = []
+        self.world_position = position
+        self.world_rotation = y_rotation
+        self.world_scale = scale
+        self.polygons = []
+        self.colliders = []
+        self.sprites = []
+        self.lo = None  # Corners of the box around everything in the subtree, None if it's empty.
+        self.hi = None
+        self._own = None  # (lo, hi) of the node's own placed objects, worked out when they're placed.
+        self._dirty = True  # The world transform is out of date.
+        self._child_dirty = True  # Something below this node is out of date.
+
+        points = []
+        count = 0
+        self._faces = []  # (start, end, color) rows of _points for each polygon.
+        self._collider_records = []
+        self._sprite_records = []
+        for record in records:
+            if record[0] == "poly":
+                self._faces.append((count, count + len(record[1]), record[2]))
+                count += len(record[1])
+                points.append(record[1])
+            elif record[0] == "sprite":
+                self._sprite_records.append(record)
+            elif record[0] != "file":
+                self._collider_records.append(record)
+        self._points = np.concatenate(points) if points else np.zeros((0, 3))
+
+    def add(self, child):
+        child.parent = self
+        self.children.append(child)
+        child.mark_dirty()
+
+    def remove(self, child):
+        self.children.remove(child)
+        child.parent = None
+        self._mark_child_dirty()
+
+    def move(self, position: Vector3 = None, y_rotation: float = None, scale: Vector3 = None):
+        """
+        Changes the node's transform relative to its parent, takes effect on the next update().
+        """
+        if position is not None:
+            self.position = position
+        if y_rotation is not None:
+            self.y_rotation = y_rotation
+        if scale is not None:
+            self.scale = scale
+        self.mark_dirty()
+
+    def mark_dirty(self):
+        self._dirty = True
+        self._child_dirty = True
+        if self.parent is not None:
+            self.parent._mark_child_dirty()
+
+    def _mark_child_dirty(self):
+        node = self
+        while node is not None and not node._child_dirty:
+            node._child_dirty = True
+            node = node.parent
+
+    def update(self) -> bool:
+        """
+        Recomputes world transforms, placed objects and bounds of the dirty parts of the subtree.
+        :return: True if anything changed.
+        """
+        if not self._child_dirty:
+            return False
+        if self._dirty:
+            self._compose()
+            self._place()
+            for child in self.children:
+                child._dirty = True
+                child._child_dirty = True
+        for child in self.children:
+            child.update()
+        self._dirty = False
+        self._child_dirty = False
+        self._bound()
+        return True
+
+    def _compose(self):
+        parent = self.parent
+        if parent is None:
+            self.world_position = self.position
+            self.world_rotation = self.y_rotation
+            self.world_scale = self.scale
+            return
+        p, s = parent.world_position, parent.world_scale
+        pos = Vector3(s.x * self.position.x, s.y * self.position.y, s.z * self.position.z)
+        pos += p
+        self.world_position = pos.rotate_around(p, Vector3(0, parent.world_rotation, 0))
+        self.world_rotation = self.y_rotation + parent.world_rotation
+        self.world_scale = Vector3(s.x * self.scale.x, s.y * self.scale.y, s.z * self.scale.z)
+
+    def _place(self):
+        """
+        Moves the node's own polygons, colliders and sprites to its world transform.
+        """
+        p, r, s = self.world_position, self.world_rotation, self.world_scale
+        world = self._points * (s.x, s.y, s.z) + (p.x, p.y, p.z)
+        # Same steps as Vector3.rotate_around, on every point at once.
+        s_y = math.sin(r * (math.pi/180))
+        c_y = math.cos(r * (math.pi/180))
+        x = world[:, 0] - p.x
+        z = world[:, 2] - p.z
+        world[:, 0] = (x * c_y - z * s_y) + p.x
+        world[:, 2] = (x * s_y + z * c_y) + p.z
+        self._world_points = world
+
+        rows = world.tolist()
+        for i, (start, end, color) in enumerate(self._faces):
+            points = [Vector3(*row) for row in rows[start:end]]
+            if i < len(self.polygons):
+                poly = self.polygons[i]
+                poly.points = points
+                poly.color = color
+            else:
+                poly = Polygon(points, Vector3(0, 0, 0), color)
+                self.polygons.append(poly)
+            poly.instantiate()
+
+        for i, (kind, n) in enumerate(self._collider_records):
+            col = build_collider(kind, n, p, r, s)
+            if i < len(self.colliders):
+                vars(self.colliders[i]).update(vars(col))
+            else:
+                self.colliders.append(col)
+
+        for i, (kind, name, n) in enumerate(self._sprite_records):
+            pos = Vector3(s.x * n[0], s.y * n[1], s.z * n[2])
+            pos += p
+            size = n[3] * max(s.x, s.y, s.z)
+            if i < len(self.sprites):
+                self.sprites[i].middle = pos
+                self.sprites[i].scale = size
+            else:
+                self.sprites.append(Sprite(pos, name, size))
+        self._own_bounds()
+
+    def _bound(self):
+        """
+        Combines the node's own box with its children's, so moving a node doesn't go over its ancestors' geometry.
+        """
+        boxes = [(child.lo, child.hi) for child in self.children if child.lo is not None]
+        if self._own is not None:
+            boxes.append(self._own)
+        if not boxes:
+            self.lo = self.hi = None
+            return
+        self.lo = tuple(min(box[0][axis] for box in boxes) for axis in range(3))
+        self.hi = tuple(max(box[1][axis] for box in boxes) for axis in range(3))
+
+    def _own_bounds(self):
+        boxes = []
+        if len(self._world_points):
+            boxes.append((tuple(self._world_points.min(axis=0).tolist()), tuple(self._world_points.max(axis=0).tolist())))
+        for col in self.colliders:
+            if type(col) == SphereCollider:
+                corners = [col.position - Vector3(col.r, col.r, col.r), col.position + Vector3(col.r, col.r, col.r)]
+            else:
+                corners = collider_corners(col)
+            boxes.append(bounds(corners))
+        for sprite in self.sprites:
+            size = Vector3(sprite.scale, sprite.scale, sprite.scale)
+            boxes.append(bounds([sprite.middle - size, sprite.middle + size]))
+        if not boxes:
+            self._own = None
+            return
+        self._own = (tuple(min(box[0][axis] for box in boxes) for axis in range(3)),
+                     tuple(max(box[1][axis] for box in boxes) for axis in range(3)))
+
+    def walk(self):
+        """
+        Yields this node and every node below it.
+        """
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            yield node
+            stack.extend(reversed(node.children))
+
+    def find(self, name: str):
+        """
+        Finds the first node loaded from a file, None if there isn't one.
+        """
+        for node in self.walk():
+            if node.name == name:
+                return node
+        return None
+
+    def items(self) -> list:
+        """
+        All the polygons and sprites in the subtree, for rendering.
+        """
+        items = []
+        for node in self.walk():
+            items.extend(node.polygons)
+            items.extend(node.sprites)
+        return items
+
+    def all_colliders(self) -> list:
+        colliders = []
+        for node in self.walk():
+            colliders.extend(node.colliders)
+        return colliders
+
+    def query(self, lo: tuple, hi: tuple):
+        """
+        Yields the nodes with their own content inside a box, skipping subtrees whose bounds are outside it.
+        """
+        stack = [self]
+        while stack:
+            node = stack.pop()
+            if node.lo is None or any(node.lo[axis] > hi[axis] or node.hi[axis] < lo[axis] for axis in range(3)):
+                continue
+            yield node
+            stack.extend(reversed(node.children))
+
+
+def bounds(points: list) -> tuple:
+    """
+    The (lo, hi) corners of the box around some Vector3s.
+    """
+    return ((min(p.x for p in points), min(p.y for p in points), min(p.z for p in points)),
+            (max(p.x for p in points), max(p.y for p in points), max(p.z for p in points)))
+
+
+def build_graph(files: dict, filename: str, position: Vector3 = Vector3(0, 0, 0), y_rotation: float = 0,
+                scale: Vector3 = Vector3(1, 1, 1)) -> SceneNode:
+    """
+    Turns a parsed include tree into nodes, each file line becoming a child node.
+    :param files: Parsed files by name, must include every file in the include tree.
+    """
+    records = files[filename].records
+    node = SceneNode(filename, records, position, y_rotation, scale)
+    for record in records:
+        if record[0] == "file":    # file <name> <position> <yrotation> <scale>
+            n = record[2]
+            node.add(build_graph(files, record[1], Vector3(n[0], n[1], n[2]), n[3], Vector3(n[4], n[5], n[6])))
+    return node
+
+
+def load_scene(filename: str, position: Vector3 = Vector3(0, 0, 0), y_rotation: float = 0,
+               scale: Vector3 = Vector3(1, 1, 1)) -> SceneNode:
+    """
+    Loads an object from Objects/ as a scene graph with its world transforms already worked out.
+    """
+    root = build_graph(AssetCache(shared_executor()).load_tree(filename), filename, position, y_rotation, scale)
+    root.update()
+    return root
@@ -0,0 +1,158 @@
+import math
+import threading
+from collections import OrderedDict
+import numpy as np
+from renderer import draw_sprite
+from framebuffer import FrameBuffer
+
+"""
+Draws sprites into a FrameBuffer by copying pre-rasterized bitmaps instead of replaying their .tur commands.
+Each sprite is rasterized once at a few scale levels, and the bitmap for the exact size it's drawn at is
+resampled from the nearest level above it and kept in a bounded cache, so drawing a sprite is one masked copy.
+"""
+
+LEVELS = (4, 8, 16, 32, 64, 128)  # Pixels per sprite unit the levels are rasterized at.
+MAX_VARIANTS = 256  # Resampled bitmaps kept for reuse.
+QUANTIZE = 4  # Sizes are rounded to 1/QUANTIZE pixels per unit so nearby sizes share a bitmap.
+
+
+class SpriteBitmap:
+    """
+    A rasterized sprite: colors, which pixels were drawn, and the pixel the sprite's start point lands on.
+    """
+    def __init__(self, colors: np.ndarray, mask: np.ndarray, origin_x: float, origin_y: float):
+        self.colors = colors
+        self.mask = mask
+        self.origin_x = origin_x
+        self.origin_y = origin_y
+
+
+class _Extent(FrameBuffer):
+    """
+    Follows a sprite's commands to find the box it covers, in sprite units.
+    """
+    def __init__(self):
+        FrameBuffer.__init__(self, 1, 1, atlas=False)
+        self.lo = [0.0, 0.0]
+        self.hi = [0.0, 0.0]
+
+    def goto(self, x: float, y: float):
+        self.lo = [min(self.lo[0], x), min(self.lo[1], y)]
+        self.hi = [max(self.hi[0], x), max(self.hi[1], y)]
+        self.x = x
+        self.y = y
+
+
+def rasterize(file: str, level: float) -> SpriteBitmap:
+    """
+    Draws a sprite into a new bitmap at [level] pixels per sprite unit.
+    """
+    extent = _Extent()
+    draw_sprite(extent, file, 0, 0, 1)
+    pad = 1 / level
+    llx = extent.lo[0] - pad
+    lly = extent.lo[1] - pad
+    width = int(math.ceil((extent.hi[0] - extent.lo[0]) * level)) + 2
+    height = int(math.ceil((extent.hi[1] - extent.lo[1]) * level)) + 2
+    # Drawn on two backgrounds, a pixel that isn't the background on either was drawn by the sprite.
+    frames = []
+    for background in ((0, 0, 0), (1, 1, 1)):
+        t = FrameBuffer(width, height, background, atlas=False)
+        t.setworldcoordinates(llx, lly, llx + width / level, lly + height / level)
+        draw_sprite(t, file, 0, 0, 1)
+        frames.append(t)
+    black = np.frombuffer(frames[0].pixels, dtype=np.uint8).reshape(height, width, 3)
+    white = np.frombuffer(frames[1].pixels, dtype=np.uint8).reshape(height, width, 3)
+    mask = (black != 0).any(axis=2) | (white != 255).any(axis=2)
+    origin_x, origin_y = frames[0].to_pixel(0, 0)
+    return SpriteBitmap(black.copy(), mask, origin_x, origin_y)
+
+
+def resample(bitmap: SpriteBitmap, scale_x: float, scale_y: float) -> SpriteBitmap:
+    """
+    Scales a bitmap by picking the nearest source pixel for each new pixel.
+    """
+    height, width = bitmap.mask.shape
+    new_width = max(1, int(math.ceil(width * scale_x)))
+    new_height = max(1, int(math.ceil(height * scale_y)))
+    columns = np.minimum(((np.arange(new_width) + 0.5) / scale_x).astype(int), width - 1)
+    rows = np.minimum(((np.arange(new_height) + 0.5) / scale_y).astype(int), height - 1)
+    return SpriteBitmap(bitmap.colors[rows][:, columns], bitmap.mask[rows][:, columns],
+                        bitmap.origin_x * scale_x, bitmap.origin_y * scale_y)
+
+
+class SpriteAtlas:
+    """
+    The rasterized levels of every sprite drawn so far and a least recently used cache of resampled sizes.
+    Safe to share between render threads.
+    """
+    def __init__(self, levels: tuple = LEVELS, max_variants: int = MAX_VARIANTS):
+        self.levels = levels
+        self.max_variants = max_variants
+        self.hits = 0
+        self.misses = 0
+        self._levels = {}  # (file, level) -> SpriteBitmap
+        self._variants = OrderedDict()  # (file, pixels per unit x, y) -> SpriteBitmap
+        self._lock = threading.Lock()
+
+    def level(self, file: str, level: float) -> SpriteBitmap:
+        with self._lock:
+            bitmap = self._levels.get((file, level))
+        if bitmap is None:
+            bitmap = rasterize(file, level)
+            with self._lock:
+                self._levels[(file, level)] = bitmap
+        return bitmap
+
+    def bitmap(self, file: str, scale_x: float, scale_y: float) -> SpriteBitmap:
+        """
+        The sprite drawn at [scale_x] by [scale_y] pixels per sprite unit, or None if that's bigger than
+        the largest level.
+        """
+        key = (file, round(scale_x * QUANTIZE) / QUANTIZE, round(scale_y * QUANTIZE) / QUANTIZE)
+        with self._lock:
+            bitmap = self._variants.get(key)
+            if bitmap is not None:
+                self._variants.move_to_end(key)
+                self.hits += 1
+                return bitmap
+            self.misses += 1
+        largest = max(key[1], key[2])
+        if largest > self.levels[-1]:
+            return None
+        level = min(level for level in self.levels if level >= largest)
+        bitmap = resample(self.level(file, level), max(key[1], 1 / QUANTIZE) / level,
+                          max(key[2], 1 / QUANTIZE) / level)
+        with self._lock:
+            self._variants[key] = bitmap
+            while len(self._variants) > self.max_variants:
+                self._variants.popitem(last=False)
+        return bitmap
+
+    def draw(self, t: FrameBuffer, file: str, x: float, y: float, size: float) -> bool:
+        """
+        Copies a sprite into a FrameBuffer the way draw_sprite would draw it.
+        :return: False if the sprite is too big for the atlas and has to be drawn from its commands.
+        """
+        llx, lly, urx, ury = t.world
+        bitmap = self.bitmap(file, size * t.width / (urx - llx), size * t.height / (ury - lly))
+        if bitmap is None:
+            return False
+        px, py = t.to_pixel(x, y)
+        left = int(round(px - bitmap.origin_x))
+        top = int(round(py - bitmap.origin_y))
+        t.blit(left, top, bitmap.colors, bitmap.mask)
+        return True
+
+
+_ATLAS = None
+
+
+def shared_atlas() -> SpriteAtlas:
+    """
+    One atlas for every FrameBuffer in the process, created the first time it's needed.
+    """
+    global _ATLAS
+    if _ATLAS is None:
+        _ATLAS = SpriteAtlas()
+    return _ATLAS